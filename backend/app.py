@@ -1,22 +1,164 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional
+from contextlib import asynccontextmanager, contextmanager, aclosing
 import os
-from openai import OpenAI
-import requests
-from bs4 import BeautifulSoup
+import sys
+import logging
+import contextvars
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessage
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 import time
 import sqlite3
 import math
 import re
+import asyncio
+import threading
+import uuid
+import hashlib
+import secrets
+import random
+import queue
+from itertools import groupby
+from difflib import get_close_matches
+from collections import OrderedDict, deque
+from functools import wraps
 
-from urllib.parse import urljoin, quote
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+
+from urllib.parse import urljoin, quote, urlsplit, urlunsplit, parse_qsl, urlencode
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Full tool results, assistant messages and scraped pages are only logged when this is set (at DEBUG level)
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "0") == "1"
+# Finished /query traces are kept in a ring buffer for /debug/traces: all slow ones, and a sample of the rest
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 200))
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", 5))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.1))
+TRACE_MAX_SPANS = 500
+# /debug/traces lists upstream URLs and timings, so it is off unless explicitly enabled
+DEBUG_TRACES_ENABLED = os.getenv("DEBUG_TRACES_ENABLED", "0") == "1"
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        trace = current_trace.get()
+        record.request_id = trace.request_id if trace else "-"
+        return True
+
+logger = logging.getLogger("partselect")
+logger.setLevel(LOG_LEVEL)
+log_handler = logging.StreamHandler(sys.stdout)
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(message)s"))
+log_handler.addFilter(RequestIdFilter())
+logger.addHandler(log_handler)
+logger.propagate = False
+
+def log_payload(label, value):
+    if LOG_PAYLOADS and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", label, value if isinstance(value, str) else json.dumps(value, indent=2, default=str))
+
+class Trace:
+    """Timed spans (LLM calls, tools, fetches, parses, DB work) recorded for one request."""
+    def __init__(self, name):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.dropped_spans = 0
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1),
+            "spans": self.spans,
+            "dropped_spans": self.dropped_spans
+        }
+
+recent_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+
+@contextmanager
+def traced_request(name):
+    trace = Trace(name)
+    # Left set on exit: this runs inside async generators, which share their caller's context,
+    # and every request is served by its own task
+    current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - trace.start
+        if trace.duration >= TRACE_SLOW_THRESHOLD or random.random() < TRACE_SAMPLE_RATE:
+            recent_traces.append(trace)
+        logger.info("%s finished in %.0f ms (%s spans)", name, trace.duration * 1000, len(trace.spans))
+
+@contextmanager
+def span(name, **attributes):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if len(trace.spans) < TRACE_MAX_SPANS:
+            trace.spans.append({
+                "name": name,
+                "start_ms": round((start - trace.start) * 1000, 1),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                **attributes
+            })
+        else:
+            trace.dropped_spans += 1
 
 def url_join(base, path):
     return urljoin(base, path)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(scrape_cache.prune)
+    index_refresher = asyncio.create_task(refresh_compatibility_index()) if COMPAT_INDEX_ENABLED else None
+    repair_refresher = asyncio.create_task(keep_repair_snapshot_fresh()) if REPAIR_SNAPSHOT_ENABLED else None
+    yield
+    if index_refresher:
+        index_refresher.cancel()
+    if repair_refresher:
+        repair_refresher.cancel()
+    await http_client.aclose()
+    await client.close()
+    await asyncio.to_thread(conversation_store.close)
+
+app = FastAPI(lifespan=lifespan)
+
+# Served at /metrics. Under several workers set PROMETHEUS_MULTIPROC_DIR so every process reports into it.
+QUERY_DURATION = Histogram("partselect_query_duration_seconds", "Time to answer a query, end to end", ["endpoint"],
+                           buckets=(0.5, 1, 2, 4, 8, 15, 30, 60, 120))
+TOOL_DURATION = Histogram("partselect_tool_duration_seconds", "Time spent in each tool call", ["tool"],
+                          buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+TOOL_ERRORS = Counter("partselect_tool_errors_total", "Tool calls that returned an error", ["tool", "reason"])
+UPSTREAM_REQUESTS = Counter("partselect_upstream_requests_total", "Requests sent to upstream sites", ["host", "status"])
+UPSTREAM_BYTES = Counter("partselect_upstream_response_bytes_total", "Response bytes received from upstream sites", ["host"])
+UPSTREAM_DURATION = Histogram("partselect_upstream_request_duration_seconds", "Upstream request latency", ["host"],
+                              buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20))
+PARSE_DURATION = Histogram("partselect_html_parse_duration_seconds", "Time to parse a fetched page", ["parser"],
+                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+OPENAI_DURATION = Histogram("partselect_openai_request_duration_seconds", "OpenAI chat completion latency", ["call"],
+                            buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+OPENAI_TOKENS = Counter("partselect_openai_tokens_total", "Tokens billed by OpenAI", ["kind"])
+PART_SEARCHES = Counter("partselect_part_searches_total", "Part name searches by where they were answered", ["source"])
+PREFETCH_LOOKUPS = Counter("partselect_prefetch_lookups_total", "Speculative item lookups by whether a tool call used them", ["outcome"])
+SQLITE_WRITE_DURATION = Histogram("partselect_sqlite_write_duration_seconds", "SQLite write transaction latency", ["db"],
+                                  buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5))
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,17 +168,1021 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+CHAT_MODEL = "gpt-4o"
 
-MAX_PARTS_PER_QUERY = 4
+MAX_PARTS_PER_QUERY = int(os.getenv("MAX_PARTS_PER_QUERY", 4))
+ITEM_LOOKUP_CONCURRENCY = int(os.getenv("ITEM_LOOKUP_CONCURRENCY", 4))
+TOOL_CALL_TIMEOUT = float(os.getenv("TOOL_CALL_TIMEOUT", 60))
+PARTS_PAGE_CONCURRENCY = int(os.getenv("PARTS_PAGE_CONCURRENCY", 6))
+MAX_PART_SEARCH_RESULTS = int(os.getenv("MAX_PART_SEARCH_RESULTS", 10))
 MAX_CONVERSATION_HISTORY = 50
 MAX_USER_MESSAGES = 50
+# Prompt history is sized in tokens: the last CONTEXT_RECENT_TURNS turns go verbatim, older tool
+# results are shortened to digests, and the oldest messages are dropped past the budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 12000))
+CONTEXT_RECENT_TURNS = max(1, int(os.getenv("CONTEXT_RECENT_TURNS", 2)))
+TOOL_DIGEST_MAX_ITEMS = 3
+TOOL_DIGEST_MAX_CHARS = 160
+# Tool results are ranked against the user's message and cut to this many manuals/diagrams/videos each, and parts
+PAYLOAD_MAX_MEDIA = int(os.getenv("PAYLOAD_MAX_MEDIA", 3))
+PAYLOAD_MAX_PARTS = int(os.getenv("PAYLOAD_MAX_PARTS", 5))
+
+try:
+    import lxml
+    DEFAULT_HTML_PARSER = "lxml"
+except ImportError:
+    DEFAULT_HTML_PARSER = "html.parser"
+
+# "lxml" is C-backed and several times faster; "html.parser" is the pure-Python fallback
+HTML_PARSER = os.getenv("HTML_PARSER", DEFAULT_HTML_PARSER)
+
+PARTSELECT_BASE_URL = os.getenv("PARTSELECT_BASE_URL", "https://www.partselect.com").rstrip('/')
+
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 15))
+# Per upstream host: concurrent requests, and a token bucket of HTTP_RATE_LIMIT requests/s (0 disables it)
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 8))
+HTTP_RATE_LIMIT = float(os.getenv("HTTP_RATE_LIMIT", 10))
+HTTP_RATE_BURST = int(os.getenv("HTTP_RATE_BURST", 20))
+# Background work (bulk compatibility jobs, index refreshes) gets at most this share of each host's
+# concurrency and rate, so chat requests always have the rest
+HTTP_BACKGROUND_SHARE = float(os.getenv("HTTP_BACKGROUND_SHARE", 0.25))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 2))
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_MAX_RETRY_DELAY = 10
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# After this many failed requests in a row a host is skipped for CIRCUIT_RESET_TIMEOUT seconds
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+
+# Pooled keep-alive client shared by every scraper, so concurrent users reuse
+# the same connections to partselect.com instead of blocking the event loop.
+http_client = httpx.AsyncClient(
+    follow_redirects=True,
+    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    limits=httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+    )
+)
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised without contacting a host whose circuit is open; scrapers report it like any other fetch failure."""
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is not responding reliably right now; skipping requests to it for the next {retry_in:.0f}s")
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Set in tasks doing background work so their fetches stay within HTTP_BACKGROUND_SHARE
+background_fetch = contextvars.ContextVar("background_fetch", default=False)
+
+class HostScheduler:
+    """Outbound policy for one upstream host: concurrency cap, rate limit and circuit breaker."""
+    def __init__(self, host):
+        self.host = host
+        self.semaphore = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+        self.bucket = TokenBucket(HTTP_RATE_LIMIT, HTTP_RATE_BURST)
+        self.background_semaphore = asyncio.Semaphore(max(1, int(HTTP_MAX_CONNECTIONS_PER_HOST * HTTP_BACKGROUND_SHARE)))
+        self.background_bucket = TokenBucket(HTTP_RATE_LIMIT * HTTP_BACKGROUND_SHARE, max(1, int(HTTP_RATE_BURST * HTTP_BACKGROUND_SHARE)))
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @asynccontextmanager
+    async def slot(self):
+        """A request slot under the host's limits; background fetches first take one from their reserved share."""
+        if not background_fetch.get():
+            async with self.semaphore:
+                await self.bucket.acquire()
+                yield
+            return
+        async with self.background_semaphore:
+            await self.background_bucket.acquire()
+            async with self.semaphore:
+                await self.bucket.acquire()
+                yield
+
+    def check_circuit(self):
+        """
+        Raise while the circuit is open. Once it has been open for CIRCUIT_RESET_TIMEOUT it is
+        half-open: a single request is let through as a probe (returns True) and the rest are
+        still refused until the probe's outcome closes or reopens the circuit.
+        """
+        if self.opened_at is None:
+            return False
+        retry_in = self.opened_at + CIRCUIT_RESET_TIMEOUT - time.monotonic()
+        if retry_in > 0 or self.probing:
+            raise CircuitOpenError(self.host, max(retry_in, 1))
+        self.probing = True
+        return True
+
+    def record(self, ok):
+        if ok:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                logger.warning("Opening circuit for %s after %s failed requests", self.host, self.consecutive_failures)
+            self.opened_at = time.monotonic()
+
+host_schedulers = {}
+
+def retry_delay(attempt, retry_after=None):
+    # Full jitter on exponential backoff, but never sooner than the server asked for
+    delay = random.uniform(0, HTTP_RETRY_BACKOFF * 2 ** attempt)
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return min(delay, HTTP_MAX_RETRY_DELAY)
+
+def has_class(*class_names):
+    wanted = set(class_names)
+    def match(value):
+        if not value:
+            return False
+        return not wanted.isdisjoint(value.split() if isinstance(value, str) else value)
+    return match
+
+# Listing and repair extractors only look inside a few blocks, so only those subtrees are built
+PARTS_LISTING_STRAINER = SoupStrainer(attrs={'class': has_class('mega-m__part', 'pagination', 'next', 'alert')})
+VIDEOS_LISTING_STRAINER = SoupStrainer(attrs={'class': has_class('yt-video', 'pagination', 'next')})
+REPAIR_PAGE_STRAINER = SoupStrainer(id='main')
+
+# Scrapers run parsing in a worker thread (asyncio.to_thread) so a large page doesn't stall other requests
+def make_soup(html, parse_only=None):
+    with PARSE_DURATION.labels(HTML_PARSER).time(), span("parse", parser=HTML_PARSER):
+        return BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
+
+async def fetch(url: str):
+    """
+    GET through the shared client under the host's scheduler. Timeouts, connection errors,
+    429 and 5xx responses are retried with jittered backoff; other errors raise immediately.
+    """
+    host = urlsplit(url).netloc.lower()
+    scheduler = host_schedulers.get(host)
+    if scheduler is None:
+        scheduler = host_schedulers[host] = HostScheduler(host)
+
+    # Checked once per request, and a request counts as one failure however many attempts it took
+    probe = scheduler.check_circuit()
+    try:
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            retry_after = None
+            async with scheduler.slot():
+                start = time.perf_counter()
+                try:
+                    with span("fetch", url=url, attempt=attempt):
+                        response = await http_client.get(url)
+                    UPSTREAM_DURATION.labels(host).observe(time.perf_counter() - start)
+                    UPSTREAM_REQUESTS.labels(host, str(response.status_code)).inc()
+                    UPSTREAM_BYTES.labels(host).inc(len(response.content))
+                    if response.status_code in HTTP_RETRY_STATUSES:
+                        retry_after = response.headers.get("Retry-After")
+                    response.raise_for_status()
+                    scheduler.record(True)
+                    return response
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in HTTP_RETRY_STATUSES:
+                        scheduler.record(True)  # the site is up, the page just isn't there
+                        raise
+                    error = e
+                except httpx.TransportError as e:
+                    UPSTREAM_DURATION.labels(host).observe(time.perf_counter() - start)
+                    UPSTREAM_REQUESTS.labels(host, type(e).__name__).inc()
+                    error = e
+            if attempt == HTTP_MAX_RETRIES:
+                scheduler.record(False)
+                raise error
+            logger.warning("Retrying %s after %r", url, error)
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+    finally:
+        if probe:
+            scheduler.probing = False
+
+SCRAPE_CACHE_ENABLED = os.getenv("SCRAPE_CACHE_ENABLED", "1") == "1"
+SCRAPE_CACHE_DB = os.getenv("SCRAPE_CACHE_DB", "scrape_cache.db")
+SCRAPE_CACHE_MAX_ENTRIES = int(os.getenv("SCRAPE_CACHE_MAX_ENTRIES", 2000))
+
+# (seconds a result stays fresh, extra seconds a stale copy may be served while it refreshes)
+SCRAPE_CACHE_TTLS = {
+    "search": (7 * 24 * 3600, 30 * 24 * 3600),      # search term -> part/model page it redirects to
+    "part": (15 * 60, 24 * 3600),                   # part pages carry price and availability
+    "part_search": (15 * 60, 24 * 3600),            # so do part search listings
+    "parts_list": (24 * 3600, 7 * 24 * 3600),       # PS/manufacturer numbers and links of a model's parts
+    "model": (7 * 24 * 3600, 30 * 24 * 3600),       # manuals, diagrams and videos
+    "repair": (7 * 24 * 3600, 30 * 24 * 3600),      # repair guides
+}
+
+def normalize_url(url: str):
+    url_parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(url_parts.query)))
+    return urlunsplit((url_parts.scheme.lower(), url_parts.netloc.lower(), url_parts.path or '/', query, ''))
+
+def is_cacheable(value):
+    if isinstance(value, dict):
+        return "error" not in value and value.get("type") != "error"
+    return bool(value)
+
+# Set in speculative lookups: a call only they are waiting on is cancelled along with them
+speculative_fetch = contextvars.ContextVar("speculative_fetch", default=False)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller starts the call and
+    everyone arriving while it runs awaits that same task and gets its result or error.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.speculative_waiters = {}  # task -> speculative callers awaiting it, until a regular caller joins
+        self.coalesced = 0
+
+    async def run(self, key, call):
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(call())
+            task.add_done_callback(lambda done: self.finish(key, done))
+            self.speculative_waiters[task] = 0
+        else:
+            self.coalesced += 1
+        if not speculative_fetch.get():
+            # Shielded so one caller timing out or disconnecting doesn't cancel the others' fetch
+            self.speculative_waiters.pop(task, None)
+            return await asyncio.shield(task)
+        if task in self.speculative_waiters:
+            self.speculative_waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task in self.speculative_waiters:
+                self.speculative_waiters[task] -= 1
+                if not self.speculative_waiters[task]:
+                    task.cancel()
+            raise
+
+    def running(self, key):
+        """The task currently running for key, if any."""
+        return self.calls.get(key)
+
+    def finish(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        self.speculative_waiters.pop(task, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved; waiters already got it
+
+class ScrapeCache:
+    """
+    Parsed scrape results keyed by kind and normalized URL or query, kept in a bounded
+    in-memory LRU backed by SQLite. Stale entries are served immediately and refreshed
+    in the background (stale-while-revalidate).
+    """
+    def __init__(self, db_path, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.background_tasks = set()
+        self.in_flight = SingleFlight()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS scrape_cache
+                             (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)''')
+        self.conn.commit()
+
+    def load(self, key):
+        with self.db_lock:
+            row = self.conn.execute("SELECT stored_at, value FROM scrape_cache WHERE key = ?", (key,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def save(self, key, entry):
+        stored_at, value = entry
+        with self.db_lock, SQLITE_WRITE_DURATION.labels("scrape_cache").time(), span("db_write", db="scrape_cache"):
+            self.conn.execute("INSERT OR REPLACE INTO scrape_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                              (key, json.dumps(value), stored_at))
+            self.conn.commit()
+
+    def prune(self):
+        oldest = time.time() - max(ttl + stale_ttl for ttl, stale_ttl in SCRAPE_CACHE_TTLS.values())
+        with self.db_lock:
+            self.conn.execute("DELETE FROM scrape_cache WHERE stored_at < ?", (oldest,))
+            self.conn.commit()
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def lookup(self, kind, key):
+        cache_key = f"{kind}:{key}"
+        entry = self.entries.get(cache_key)
+        if entry is None:
+            entry = await asyncio.to_thread(self.load, cache_key)
+            if entry is None:
+                return cache_key, None, None
+        self.remember(cache_key, entry)
+        stored_at, value = entry
+        return cache_key, value, time.time() - stored_at
+
+    async def store(self, cache_key, value):
+        if is_cacheable(value):
+            entry = (time.time(), value)
+            self.remember(cache_key, entry)
+            await asyncio.to_thread(self.save, cache_key, entry)
+
+    async def peek(self, kind, key):
+        """Return a cached value that is fresh or still within its stale window, without fetching."""
+        if not SCRAPE_CACHE_ENABLED:
+            return None
+        ttl, stale_ttl = SCRAPE_CACHE_TTLS[kind]
+        _, value, age = await self.lookup(kind, key)
+        return value if value is not None and age < ttl + stale_ttl else None
+
+    async def get_or_fetch(self, kind, key, fetcher):
+        if not SCRAPE_CACHE_ENABLED:
+            return await self.in_flight.run(f"{kind}:{key}", fetcher)
+
+        ttl, stale_ttl = SCRAPE_CACHE_TTLS[kind]
+        cache_key, value, age = await self.lookup(kind, key)
+        if value is not None and age < ttl:
+            self.hits += 1
+            return value
+        if value is not None and age < ttl + stale_ttl:
+            self.stale_hits += 1
+            self.refresh_in_background(cache_key, fetcher)
+            return value
+
+        self.misses += 1
+        return await self.in_flight.run(cache_key, lambda: self.fetch_and_store(cache_key, fetcher))
+
+    async def fetch_and_store(self, cache_key, fetcher):
+        value = await fetcher()
+        await self.store(cache_key, value)
+        return value
+
+    def refresh_in_background(self, cache_key, fetcher):
+        if cache_key in self.refreshing:
+            return
+        self.refreshing.add(cache_key)
+
+        async def refresh():
+            try:
+                await self.store(cache_key, await fetcher())
+            except Exception as e:
+                logger.error("Error refreshing cache entry %s: %s", cache_key, e)
+            finally:
+                self.refreshing.discard(cache_key)
+
+        task = asyncio.create_task(refresh())
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.in_flight.coalesced,
+            "refreshing": len(self.refreshing)
+        }
+
+scrape_cache = ScrapeCache(SCRAPE_CACHE_DB, SCRAPE_CACHE_MAX_ENTRIES)
+
+COMPAT_INDEX_ENABLED = os.getenv("COMPAT_INDEX_ENABLED", "1") == "1"
+COMPAT_INDEX_DB = os.getenv("COMPAT_INDEX_DB", "catalog.db")
+# A model's full parts list is trusted to answer "not compatible" for this long after its crawl
+COMPAT_INDEX_MAX_AGE = int(os.getenv("COMPAT_INDEX_MAX_AGE", 7 * 24 * 3600))
+COMPAT_INDEX_REFRESH_INTERVAL = int(os.getenv("COMPAT_INDEX_REFRESH_INTERVAL", 6 * 3600))
+# Only models a chat asked about within this long are kept fresh, at most this many per refresh cycle
+COMPAT_INDEX_REFRESH_LOOKBACK = int(os.getenv("COMPAT_INDEX_REFRESH_LOOKBACK", COMPAT_INDEX_MAX_AGE))
+COMPAT_INDEX_REFRESH_BATCH = int(os.getenv("COMPAT_INDEX_REFRESH_BATCH", 50))
+
+def normalize_part_number(number: str):
+    return number.strip().upper() if number else number
+
+def model_number_from_url(model_url: str):
+    match = re.search(r'/Models/([^/?#]+)', model_url)
+    return normalize_part_number(match.group(1)) if match else None
+
+class CompatibilityIndex:
+    """
+    Per model, the PS and manufacturer numbers of its known parts plus the time of its last
+    full parts crawl, held in memory for O(1) membership checks and persisted to SQLite.
+    """
+    def __init__(self, db_path):
+        self.parts = {}       # model -> {ps_number: (mfg_number, url)}
+        self.numbers = {}     # model -> {ps or manufacturer number: ps_number}
+        self.crawled_at = {}  # model -> time of the last complete crawl
+        self.part_models = {} # ps or manufacturer number -> set of models
+        self.looked_up_at = {} # model -> time of its last chat lookup in this process, not yet saved
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS model_parts
+                             (model_number TEXT, ps_number TEXT, mfg_number TEXT, url TEXT,
+                              PRIMARY KEY (model_number, ps_number))''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS model_crawls
+                             (model_number TEXT PRIMARY KEY, crawled_at REAL)''')
+        # Shared by every worker: which models are still being asked about, and which worker is refreshing which
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS model_lookups
+                             (model_number TEXT PRIMARY KEY, looked_up_at REAL)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS model_refresh_claims
+                             (model_number TEXT PRIMARY KEY, owner TEXT, claimed_at REAL)''')
+        self.conn.commit()
+        self.load()
+
+    def load(self):
+        with self.db_lock:
+            for model_number, ps_number, mfg_number, url in self.conn.execute("SELECT model_number, ps_number, mfg_number, url FROM model_parts"):
+                self.add(model_number, ps_number, mfg_number, url)
+            for model_number, crawled_at in self.conn.execute("SELECT model_number, crawled_at FROM model_crawls"):
+                self.crawled_at[model_number] = crawled_at
+
+    def add(self, model_number, ps_number, mfg_number, url):
+        self.parts.setdefault(model_number, {})[ps_number] = (mfg_number, url)
+        numbers = self.numbers.setdefault(model_number, {})
+        for number in (ps_number, mfg_number):
+            if number:
+                numbers[number] = ps_number
+                self.part_models.setdefault(number, set()).add(model_number)
+
+    def forget(self, model_number):
+        for number in self.numbers.pop(model_number, {}):
+            models = self.part_models.get(number)
+            if models:
+                models.discard(model_number)
+                if not models:
+                    del self.part_models[number]
+        self.parts.pop(model_number, None)
+
+    async def record(self, model_number, parts, complete):
+        """
+        Add the PartCards seen for a model. A complete crawl replaces what was known about the
+        model and stamps its crawl time; partial results (early exits, name searches) only add.
+        """
+        if not COMPAT_INDEX_ENABLED or not model_number:
+            return
+        rows = [
+            (model_number, normalize_part_number(card.ps_number), normalize_part_number(card.mfg_number), card.url)
+            for card in parts if card.ps_number
+        ]
+        crawled_at = time.time()
+        if complete:
+            self.forget(model_number)
+            self.crawled_at[model_number] = crawled_at
+        for row in rows:
+            self.add(*row)
+        await asyncio.to_thread(self.save, model_number, rows, complete, crawled_at)
+
+    def save(self, model_number, rows, complete, crawled_at):
+        with self.db_lock, SQLITE_WRITE_DURATION.labels("catalog").time(), span("db_write", db="catalog"):
+            if complete:
+                self.conn.execute("DELETE FROM model_parts WHERE model_number = ?", (model_number,))
+                self.conn.execute("INSERT OR REPLACE INTO model_crawls (model_number, crawled_at) VALUES (?, ?)", (model_number, crawled_at))
+            self.conn.executemany("INSERT OR REPLACE INTO model_parts (model_number, ps_number, mfg_number, url) VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def lookup(self, model_number, part_number):
+        """
+        Return (True, part) if the part is known to fit the model, (False, None) if a fresh
+        complete crawl of the model doesn't list it, or (None, None) if the index can't tell.
+        """
+        if not COMPAT_INDEX_ENABLED:
+            return None, None
+        model_number = normalize_part_number(model_number)
+        if not background_fetch.get():
+            self.looked_up_at[model_number] = time.time()
+        ps_number = self.numbers.get(model_number, {}).get(normalize_part_number(part_number))
+        if ps_number:
+            mfg_number, url = self.parts[model_number][ps_number]
+            part = {"ps_number": ps_number}
+            if mfg_number:
+                part["mfg_number"] = mfg_number
+            if url:
+                part["url"] = url
+            return True, part
+        if time.time() - self.crawled_at.get(model_number, 0) < COMPAT_INDEX_MAX_AGE:
+            return False, None
+        return None, None
+
+    def models_for_part(self, part_number):
+        return sorted(self.part_models.get(normalize_part_number(part_number), ()))
+
+    def save_lookups(self):
+        looked_up_at, self.looked_up_at = self.looked_up_at, {}
+        with self.db_lock:
+            self.conn.executemany('''INSERT INTO model_lookups (model_number, looked_up_at) VALUES (?, ?)
+                                     ON CONFLICT (model_number) DO UPDATE SET looked_up_at = MAX(looked_up_at, excluded.looked_up_at)''',
+                                  looked_up_at.items())
+            self.conn.commit()
+
+    def stale_models(self, limit):
+        """Models asked about recently whose last complete crawl, by any worker, has aged out."""
+        now = time.time()
+        with self.db_lock:
+            rows = self.conn.execute('''SELECT model_number FROM model_crawls JOIN model_lookups USING (model_number)
+                                        WHERE crawled_at <= ? AND looked_up_at >= ? ORDER BY looked_up_at DESC LIMIT ?''',
+                                     (now - COMPAT_INDEX_MAX_AGE, now - COMPAT_INDEX_REFRESH_LOOKBACK, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def claim_refresh(self, model_number, owner):
+        """Claim a model's refresh for one refresh interval, so only one worker re-crawls it."""
+        now = time.time()
+        with self.db_lock:
+            cursor = self.conn.execute('''INSERT INTO model_refresh_claims (model_number, owner, claimed_at) VALUES (?, ?, ?)
+                                           ON CONFLICT (model_number) DO UPDATE SET owner = excluded.owner, claimed_at = excluded.claimed_at
+                                           WHERE model_refresh_claims.claimed_at <= ?''',
+                                       (model_number, owner, now, now - COMPAT_INDEX_REFRESH_INTERVAL))
+            self.conn.commit()
+        return cursor.rowcount == 1
+
+compatibility_index = CompatibilityIndex(COMPAT_INDEX_DB)
+
+async def refresh_compatibility_index():
+    """
+    Periodically re-crawl the parts lists of models still being asked about once they age out
+    of the index. Every worker runs this; each stale model is claimed by one of them.
+    """
+    owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    background_fetch.set(True)
+    while True:
+        await asyncio.sleep(COMPAT_INDEX_REFRESH_INTERVAL)
+        await asyncio.to_thread(compatibility_index.save_lookups)
+        for model_number in await asyncio.to_thread(compatibility_index.stale_models, COMPAT_INDEX_REFRESH_BATCH):
+            if not await asyncio.to_thread(compatibility_index.claim_refresh, model_number, owner):
+                continue
+            try:
+                logger.info("Refreshing compatibility index for model %s", model_number)
+                parts = await crawl_all_parts(f"{PARTSELECT_BASE_URL}/Models/{model_number}/")
+                await scrape_cache.store(f"parts_list:{normalize_url(f'{PARTSELECT_BASE_URL}/Models/{model_number}/Parts/')}", parts)
+            except Exception as e:
+                logger.error("Error refreshing compatibility index for model %s: %s", model_number, e)
+
+CATALOG_DB = os.getenv("CATALOG_DB", COMPAT_INDEX_DB)
+# Answer part and model lookups from the crawled catalog before scraping (see crawl_catalog.py)
+CATALOG_LOCAL_FIRST = os.getenv("CATALOG_LOCAL_FIRST", "0") == "1"
+# The crawler re-fetches catalog records older than this
+CATALOG_MAX_AGE = float(os.getenv("CATALOG_MAX_AGE", 7 * 24 * 60 * 60))
+# Price and availability change too often to keep for CATALOG_MAX_AGE, so part records are stored without them
+CATALOG_VOLATILE_FIELDS = ("price", "availability")
+
+def content_hash(record):
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+class Catalog:
+    """
+    Model and part records built offline by crawl_catalog.py, stored exactly as search_model and
+    search_part return them, plus the crawler's per-model checkpoint. Records carry a content
+    hash so re-crawling an unchanged page only refreshes its timestamp.
+    """
+    def __init__(self, db_path):
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS catalog_models
+                             (model_number TEXT PRIMARY KEY, record TEXT, content_hash TEXT, checked_at REAL, changed_at REAL)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS catalog_parts
+                             (ps_number TEXT PRIMARY KEY, mfg_number TEXT, record TEXT, content_hash TEXT, checked_at REAL, changed_at REAL)''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS catalog_parts_by_mfg_number ON catalog_parts (mfg_number)")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS catalog_crawl
+                             (model_number TEXT PRIMARY KEY, status TEXT, updated_at REAL)''')
+        self.conn.commit()
+
+    def find_item(self, number, max_age=CATALOG_MAX_AGE):
+        """The stored model or part record for a model, PS or manufacturer number, or None if absent or older than max_age."""
+        number = normalize_part_number(number)
+        checked_after = time.time() - max_age
+        with self.db_lock:
+            row = self.conn.execute("SELECT record FROM catalog_models WHERE model_number = ? AND checked_at >= ?",
+                                    (number, checked_after)).fetchone()
+            if row is None:
+                row = self.conn.execute("SELECT record FROM catalog_parts WHERE (ps_number = ? OR mfg_number = ?) AND checked_at >= ? LIMIT 1",
+                                        (number, number, checked_after)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def part_age(self, ps_number):
+        with self.db_lock:
+            row = self.conn.execute("SELECT checked_at FROM catalog_parts WHERE ps_number = ?", (normalize_part_number(ps_number),)).fetchone()
+        return time.time() - row[0] if row else None
+
+    def save(self, table, key_column, key, record, extra=None):
+        """Store a record, returning whether it differs from the stored one."""
+        record_hash = content_hash(record)
+        now = time.time()
+        extra = extra or {}
+        with self.db_lock, SQLITE_WRITE_DURATION.labels("catalog").time():
+            row = self.conn.execute(f"SELECT content_hash FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+            if row and row[0] == record_hash:
+                self.conn.execute(f"UPDATE {table} SET checked_at = ? WHERE {key_column} = ?", (now, key))
+                changed = False
+            else:
+                columns = [key_column, *extra, "record", "content_hash", "checked_at", "changed_at"]
+                self.conn.execute(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                  (key, *extra.values(), json.dumps(record), record_hash, now, now))
+                changed = True
+            self.conn.commit()
+        return changed
+
+    def save_model(self, model_number, record):
+        return self.save("catalog_models", "model_number", normalize_part_number(model_number), record)
+
+    def save_part(self, record):
+        record = {field: value for field, value in record.items() if field not in CATALOG_VOLATILE_FIELDS}
+        return self.save("catalog_parts", "ps_number", normalize_part_number(record["ps_number"]), record,
+                         {"mfg_number": normalize_part_number(record.get("mfg_number"))})
+
+    def queue_models(self, model_numbers, force=False):
+        """Add models to the crawl checkpoint; ones crawled within CATALOG_MAX_AGE stay done unless forced."""
+        fresh_after = float("inf") if force else time.time() - CATALOG_MAX_AGE
+        with self.db_lock:
+            for model_number in model_numbers:
+                self.conn.execute('''INSERT INTO catalog_crawl (model_number, status, updated_at) VALUES (?, 'pending', ?)
+                                     ON CONFLICT (model_number) DO UPDATE SET status = 'pending', updated_at = excluded.updated_at
+                                     WHERE status != 'done' OR updated_at < ?''',
+                                  (normalize_part_number(model_number), time.time(), fresh_after))
+            self.conn.commit()
+
+    def pending_models(self):
+        with self.db_lock:
+            return [row[0] for row in self.conn.execute("SELECT model_number FROM catalog_crawl WHERE status != 'done' ORDER BY updated_at")]
+
+    def mark_model(self, model_number, status):
+        with self.db_lock:
+            self.conn.execute("UPDATE catalog_crawl SET status = ?, updated_at = ? WHERE model_number = ?",
+                              (status, time.time(), normalize_part_number(model_number)))
+            self.conn.commit()
+
+catalog = Catalog(CATALOG_DB)
+
+PART_SEARCH_INDEX_ENABLED = os.getenv("PART_SEARCH_INDEX_ENABLED", "1") == "1"
+PART_SEARCH_DB = os.getenv("PART_SEARCH_DB", COMPAT_INDEX_DB)
+# A model's indexed parts list is trusted for name searches for this long after its last full crawl
+PART_SEARCH_MAX_AGE = float(os.getenv("PART_SEARCH_MAX_AGE", COMPAT_INDEX_MAX_AGE))
+# Models whose part vocabularies are kept in memory for typo correction
+PART_SEARCH_VOCABULARY_CACHE_SIZE = int(os.getenv("PART_SEARCH_VOCABULARY_CACHE_SIZE", 256))
+# BM25 weights for the name, description and symptoms columns
+PART_SEARCH_WEIGHTS = (10.0, 2.0, 1.0)
+# Price and availability change too often to keep for PART_SEARCH_MAX_AGE, so only these are indexed
+PART_INDEX_FIELDS = ('name', 'url', 'ps_number', 'mfg_number')
+
+class PartSearchIndex:
+    """
+    SQLite FTS5 index over the name, description and symptoms of every part of each fully
+    crawled model, so name searches on those models are answered locally, BM25-ranked, instead
+    of paging through the site's search. Descriptions and symptoms come from scraped part pages
+    and are kept per part, so they carry over to every model the part fits.
+    """
+    def __init__(self, db_path):
+        self.enabled = PART_SEARCH_INDEX_ENABLED
+        self.vocabularies = OrderedDict()  # model number -> sorted words of its indexed parts, for typo correction
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            self.conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS part_search USING fts5
+                                 (name, description, symptoms, model_number UNINDEXED, ps_number UNINDEXED, card UNINDEXED,
+                                  tokenize = 'porter unicode61', prefix = '2 3')''')
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite has no FTS5, so part name searches always go to the site: %s", e)
+            self.enabled = False
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS part_details
+                             (ps_number TEXT PRIMARY KEY, description TEXT, symptoms TEXT)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS part_search_models
+                             (model_number TEXT PRIMARY KEY, indexed_at REAL)''')
+        self.conn.commit()
+
+    def is_indexed(self, model_number):
+        with self.db_lock:
+            row = self.conn.execute("SELECT indexed_at FROM part_search_models WHERE model_number = ?",
+                                    (normalize_part_number(model_number),)).fetchone()
+        return row is not None and time.time() - row[0] < PART_SEARCH_MAX_AGE
+
+    async def record(self, model_number, cards):
+        """Replace a model's indexed parts with the PartCards of a complete crawl."""
+        if self.enabled and model_number:
+            await asyncio.to_thread(self.index_model, normalize_part_number(model_number), cards)
+
+    def index_model(self, model_number, cards):
+        rows = [
+            (card.name or "", card.ps_number, card.ps_number, model_number, card.ps_number, json.dumps(card.to_dict(PART_INDEX_FIELDS)))
+            for card in cards if card.ps_number
+        ]
+        with self.db_lock, SQLITE_WRITE_DURATION.labels("part_search").time(), span("db_write", db="part_search"):
+            self.conn.execute("DELETE FROM part_search WHERE model_number = ?", (model_number,))
+            self.conn.executemany('''INSERT INTO part_search (name, description, symptoms, model_number, ps_number, card)
+                                     VALUES (?, COALESCE((SELECT description FROM part_details WHERE ps_number = ?), ''),
+                                             COALESCE((SELECT symptoms FROM part_details WHERE ps_number = ?), ''), ?, ?, ?)''', rows)
+            self.conn.execute("INSERT OR REPLACE INTO part_search_models (model_number, indexed_at) VALUES (?, ?)", (model_number, time.time()))
+            self.conn.commit()
+            self.vocabularies.pop(model_number, None)
+
+    async def record_details(self, part_info):
+        """Add the description and symptoms from a scraped part page."""
+        if self.enabled and part_info.get("ps_number"):
+            await asyncio.to_thread(self.index_details, part_info)
+
+    def index_details(self, part_info):
+        ps_number = normalize_part_number(part_info["ps_number"])
+        details = (part_info.get("product_description") or "", part_info.get("symptoms_it_fixes") or "")
+        with self.db_lock:
+            if self.conn.execute("SELECT description, symptoms FROM part_details WHERE ps_number = ?", (ps_number,)).fetchone() == details:
+                return
+            with SQLITE_WRITE_DURATION.labels("part_search").time(), span("db_write", db="part_search"):
+                self.conn.execute("INSERT OR REPLACE INTO part_details (ps_number, description, symptoms) VALUES (?, ?, ?)", (ps_number, *details))
+                self.conn.execute("UPDATE part_search SET description = ?, symptoms = ? WHERE ps_number = ?", (*details, ps_number))
+                self.conn.commit()
+            if self.vocabularies:
+                for (model_number,) in self.conn.execute("SELECT DISTINCT model_number FROM part_search WHERE ps_number = ?", (ps_number,)):
+                    self.vocabularies.pop(model_number, None)
+
+    def terms(self, model_number):
+        """The sorted distinct words of a model's indexed parts, cached until the model is re-indexed."""
+        with self.db_lock:
+            vocabulary = self.vocabularies.get(model_number)
+            if vocabulary is not None:
+                self.vocabularies.move_to_end(model_number)
+                return vocabulary
+            rows = self.conn.execute("SELECT name, description, symptoms FROM part_search WHERE model_number = ?",
+                                     (model_number,)).fetchall()
+        vocabulary = sorted({word for row in rows for word in RELEVANCE_TERM_PATTERN.findall(" ".join(row).lower())})
+        with self.db_lock:
+            self.vocabularies[model_number] = vocabulary
+            while len(self.vocabularies) > PART_SEARCH_VOCABULARY_CACHE_SIZE:
+                self.vocabularies.popitem(last=False)
+        return vocabulary
+
+    def match_expression(self, model_number, part_name):
+        """
+        An FTS5 query requiring every word of the name, each as itself (which FTS5 stems) or as a
+        prefix, or, for words neither form finds in the model's parts, any close spelling of it
+        that they contain. Stopwords and single characters (the "s" of "door's") are left out.
+        """
+        groups = []
+        for word in RELEVANCE_TERM_PATTERN.findall(part_name.lower()):
+            if len(word) < 2 or word in RELEVANCE_STOPWORDS:
+                continue
+            alternatives = [f'"{word}"', f'"{word}"*']
+            with self.db_lock:
+                found = self.conn.execute("SELECT 1 FROM part_search WHERE part_search MATCH ? AND model_number = ? LIMIT 1",
+                                          (" OR ".join(alternatives), model_number)).fetchone()
+            if not found:
+                alternatives.extend(f'"{term}"' for term in get_close_matches(word, self.terms(model_number), n=3, cutoff=0.75))
+            groups.append(f"({' OR '.join(alternatives)})")
+        return " AND ".join(groups)
+
+    def search(self, model_number, part_name, limit):
+        model_number = normalize_part_number(model_number)
+        expression = self.match_expression(model_number, part_name)
+        if not expression:
+            return []
+        with self.db_lock:
+            rows = self.conn.execute(f'''SELECT card FROM part_search WHERE part_search MATCH ? AND model_number = ?
+                                         ORDER BY bm25(part_search, {", ".join(map(str, PART_SEARCH_WEIGHTS))}) LIMIT ?''',
+                                     (expression, model_number, limit)).fetchall()
+        return [PartCard.from_dict(json.loads(row[0])).to_dict(PART_INDEX_FIELDS) for row in rows]
+
+part_search_index = PartSearchIndex(PART_SEARCH_DB)
+
+CONVERSATIONS_DB = os.getenv("CONVERSATIONS_DB", "conversations.db")
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", 1000))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", 30 * 60))
+# Messages are written behind the request path; once this many are pending, new writes wait for the writer
+CONVERSATION_WRITE_QUEUE_SIZE = int(os.getenv("CONVERSATION_WRITE_QUEUE_SIZE", 1000))
+# How long a turn waits for room in a full write queue before its message is only kept in memory
+CONVERSATION_WRITE_TIMEOUT = float(os.getenv("CONVERSATION_WRITE_TIMEOUT", 5))
+CONVERSATION_WRITE_BATCH_SIZE = 200
+# A worker holds a session's lease for the length of a turn; a lease older than this is
+# assumed to belong to a worker that died mid-turn and can be taken over
+SESSION_LEASE_TIMEOUT = float(os.getenv("SESSION_LEASE_TIMEOUT", 300))
+SESSION_LEASE_POLL_INTERVAL = 0.1
+# Clients that send no session_id (such as the built extension) share this one conversation,
+# as every client did before sessions existed
+LEGACY_SESSION_ID = "default"
 
 class Query(BaseModel):
     query: str
+    session_id: Optional[str] = Field(default=None, max_length=128)
+
+class SessionRequest(BaseModel):
+    session_id: Optional[str] = Field(default=None, max_length=128)
+
+class CompatibilityPair(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_number: str = Field(min_length=1, max_length=64)
+    part_number: str = Field(min_length=1, max_length=64)
+
+class BulkCompatibilityRequest(BaseModel):
+    pairs: list[CompatibilityPair]
+
+class ConversationStore:
+    """
+    conversations.db behind one long-lived WAL-mode connection. The schema is created once;
+    writes go through a bounded queue to a background thread that groups whatever is pending
+    into a single transaction, so no request waits on a commit. Writes and reads are tagged with
+    a session ID, and a read waits only for that session's pending writes.
+    """
+    def __init__(self, db_path, max_pending):
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS messages
+                             (conversation_id TEXT, role TEXT, content TEXT, name TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id)")
+        # Which conversation each browser session is currently on; /reset points it at a new one
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                             (session_id TEXT PRIMARY KEY, conversation_id TEXT, updated_at REAL)''')
+        # Which worker is running a turn on each session, so turns never interleave across processes
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS session_leases
+                             (session_id TEXT PRIMARY KEY, owner TEXT, expires_at REAL)''')
+        self.conn.commit()
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.unwritten = {}  # session ID -> writes queued but not yet committed
+        self.written = threading.Condition()
+        self.writer = threading.Thread(target=self.write_pending, name="conversation-writer", daemon=True)
+        self.writer.start()
+
+    def write(self, key, statement, params, block=True, timeout=None):
+        """Queue a write, blocking while the queue is full; only call this off the event loop."""
+        with self.written:
+            self.unwritten[key] = self.unwritten.get(key, 0) + 1
+        try:
+            self.pending.put((key, statement, params), block, timeout)
+        except queue.Full:
+            self.mark_written([key])
+            raise
+
+    async def write_async(self, key, statement, params):
+        """Queue a write from the event loop; if the queue is full, the wait happens in a worker thread."""
+        try:
+            self.write(key, statement, params, block=False)
+        except queue.Full:
+            try:
+                await asyncio.to_thread(self.write, key, statement, params, True, CONVERSATION_WRITE_TIMEOUT)
+            except queue.Full:
+                logger.error("Conversation write queue still full after %ss, not saving a message for session %s",
+                             CONVERSATION_WRITE_TIMEOUT, key)
+
+    def mark_written(self, keys):
+        with self.written:
+            for key in keys:
+                self.unwritten[key] -= 1
+                if not self.unwritten[key]:
+                    del self.unwritten[key]
+            self.written.notify_all()
+
+    def write_pending(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < CONVERSATION_WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            writes = [write for write in batch if write is not None]
+            try:
+                with self.db_lock, SQLITE_WRITE_DURATION.labels("conversations").time(), self.conn:
+                    for statement, group in groupby(writes, key=lambda write: write[1]):
+                        self.conn.executemany(statement, [params for _, _, params in group])
+            except sqlite3.Error as e:
+                logger.error("Error writing %s conversation rows: %s", len(writes), e)
+            finally:
+                self.mark_written([key for key, _, _ in writes])
+            if len(writes) < len(batch):
+                return
+
+    def read(self, key, statement, params=()):
+        self.wait_for_writes(key)
+        with self.db_lock:
+            return self.conn.execute(statement, params).fetchall()
+
+    def wait_for_writes(self, key):
+        with self.written:
+            self.written.wait_for(lambda: key not in self.unwritten)
+
+    @asynccontextmanager
+    async def lease(self, key):
+        """Hold a session's lease for a turn, waiting while another worker holds it."""
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        while not await asyncio.to_thread(self.try_lease, key, owner):
+            await asyncio.sleep(SESSION_LEASE_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.release_lease, key, owner)
+
+    def try_lease(self, key, owner):
+        now = time.time()
+        with self.db_lock, self.conn:
+            cursor = self.conn.execute('''INSERT INTO session_leases (session_id, owner, expires_at) VALUES (?, ?, ?)
+                                         ON CONFLICT (session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                                         WHERE session_leases.expires_at < ?''',
+                                       (key, owner, now + SESSION_LEASE_TIMEOUT, now))
+            return cursor.rowcount == 1
+
+    def release_lease(self, key, owner):
+        # The next worker to take the session must see this turn's messages
+        self.wait_for_writes(key)
+        with self.db_lock, self.conn:
+            self.conn.execute("DELETE FROM session_leases WHERE session_id = ? AND owner = ?", (key, owner))
+
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+        self.conn.close()
+
+conversation_store = ConversationStore(CONVERSATIONS_DB, CONVERSATION_WRITE_QUEUE_SIZE)
+
+try:
+    import tiktoken
+    TOKEN_ENCODING = tiktoken.encoding_for_model(CHAT_MODEL)
+except Exception:
+    # Not installed, or its vocabulary can't be downloaded; estimate ~4 characters per token instead
+    TOKEN_ENCODING = None
+
+def cache_by_content_hash(maxsize):
+    """
+    An LRU cache for a function of one string, keyed by a hash of the string so that caching
+    results for whole tool payloads doesn't keep the payloads themselves in memory.
+    """
+    def decorator(function):
+        results = OrderedDict()
+
+        @wraps(function)
+        def cached(text):
+            key = hashlib.blake2b(text.encode(), digest_size=16).digest() if isinstance(text, str) else text
+            if key in results:
+                results.move_to_end(key)
+                return results[key]
+            result = results[key] = function(text)
+            if len(results) > maxsize:
+                results.popitem(last=False)
+            return result
+        return cached
+    return decorator
+
+@cache_by_content_hash(maxsize=4096)
+def count_text_tokens(text):
+    if TOKEN_ENCODING is None:
+        return math.ceil(len(text) / 4)
+    return len(TOKEN_ENCODING.encode(text, disallowed_special=()))
+
+def count_message_tokens(message):
+    # Each message also costs a few tokens for its role and separators
+    tokens = 4 + count_text_tokens(message.get("content") or "")
+    if message.get("name"):
+        tokens += count_text_tokens(message["name"])
+    return tokens
+
+def compact_tool_value(value):
+    if isinstance(value, str):
+        if len(value) <= TOOL_DIGEST_MAX_CHARS or value.startswith("{{display:"):
+            return value
+        return value[:TOOL_DIGEST_MAX_CHARS] + "..."
+    if isinstance(value, list):
+        kept = [compact_tool_value(item) for item in value[:TOOL_DIGEST_MAX_ITEMS]]
+        if len(value) > TOOL_DIGEST_MAX_ITEMS:
+            kept.append(f"({len(value) - TOOL_DIGEST_MAX_ITEMS} more not shown)")
+        return kept
+    if isinstance(value, dict):
+        return {key: compact_tool_value(item) for key, item in value.items()}
+    return value
+
+@cache_by_content_hash(maxsize=1024)
+def digest_tool_result(content):
+    try:
+        result = json.loads(content)
+    except (TypeError, ValueError):
+        return compact_tool_value(content)
+    return json.dumps({
+        "note": "Shortened result from an earlier turn; call the function again if you need the full details",
+        "result": compact_tool_value(result)
+    })
 
 class Conversation:
-    def __init__(self):
+    def __init__(self, session_id=None, conversation_id=None):
         self.messages = [
             {"role": "system", "content": """You are a helpful assistant for a parts website called partselect. 
              Use the get_part_or_model_info function when a user asks about specific parts or models by number (if called with model number, it also returns installation instruction videos for some common parts of it).
@@ -98,16 +1244,22 @@ Match the user's description to the closest symptom from this list.
              """}
         ]
         self.user_message_count = 0
-        self.conversation_id = self.generate_conversation_id()
+        self.session_id = session_id
+        self.conversation_id = conversation_id or self.generate_conversation_id()
+        # Messages ever added to this conversation, compared with the database to spot writes from other workers
+        self.message_count = 0
+        # Estimated size of the last prompt built by get_messages
+        self.prompt_tokens = 0
 
     def generate_conversation_id(self):
-        return str(int(time.time()))
+        return uuid.uuid4().hex
 
-    def add_message(self, role, content, name=None):
+    async def add_message(self, role, content, name=None):
         message = {"role": role, "content": content}
         if name:
             message["name"] = name
         self.messages.append(message)
+        self.message_count += 1
         
         if role == "user":
             self.user_message_count += 1
@@ -115,257 +1267,458 @@ Match the user's description to the closest symptom from this list.
         if len(self.messages) > MAX_CONVERSATION_HISTORY + 1:
             self.messages = [self.messages[0]] + self.messages[-(MAX_CONVERSATION_HISTORY):]
 
-        self.save_message_to_db(role, content, name)
+        await self.save_message_to_db(role, content, name)
 
     def get_messages(self):
-        return self.messages
+        """
+        Build the prompt history within CONTEXT_TOKEN_BUDGET: recent turns verbatim,
+        older function results as digests, and the oldest messages dropped if still over.
+        """
+        system, history = self.messages[0], self.messages[1:]
+        user_positions = [i for i, message in enumerate(history) if message["role"] == "user"]
+        recent_start = user_positions[-CONTEXT_RECENT_TURNS] if len(user_positions) >= CONTEXT_RECENT_TURNS else 0
+        older = [
+            {**message, "content": digest_tool_result(message["content"])} if message["role"] == "function" else message
+            for message in history[:recent_start]
+        ]
+        recent = history[recent_start:]
+
+        tokens = sum(count_message_tokens(message) for message in [system, *older, *recent])
+        dropped = 0
+        # Drop whole turns so the history never opens on a reply whose question is gone
+        while older and (tokens > CONTEXT_TOKEN_BUDGET or older[0]["role"] != "user"):
+            tokens -= count_message_tokens(older.pop(0))
+            dropped += 1
+        self.prompt_tokens = tokens
+        if dropped:
+            logger.info("Dropped %s old messages to keep the prompt within %s tokens", dropped, CONTEXT_TOKEN_BUDGET)
+        return [system, *older, *recent]
 
-    def save_message_to_db(self, role, content, name=None):
-        conn = sqlite3.connect('conversations.db')
-        c = conn.cursor()
+    async def save_message_to_db(self, role, content, name=None):
+        await conversation_store.write_async(self.session_id, "INSERT INTO messages (conversation_id, role, content, name) VALUES (?, ?, ?, ?)",
+                                             (self.conversation_id, role, content, name))
 
-        c.execute('''CREATE TABLE IF NOT EXISTS messages
-                     (conversation_id TEXT, role TEXT, content TEXT, name TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    def save_session_to_db(self):
+        if self.session_id is not None:
+            conversation_store.write(self.session_id, "INSERT OR REPLACE INTO sessions (session_id, conversation_id, updated_at) VALUES (?, ?, ?)",
+                                     (self.session_id, self.conversation_id, time.time()))
 
-        c.execute("INSERT INTO messages (conversation_id, role, content, name) VALUES (?, ?, ?, ?)",
-                  (self.conversation_id, role, content, name))
+    @classmethod
+    def load(cls, session_id, current=None):
+        """
+        Rebuild a session's conversation from the database so any worker can pick it up.
+        Returns current unchanged when nothing was written or reset elsewhere since it was loaded.
+        """
+        row = conversation_store.read(session_id, '''SELECT conversation_id,
+                                         (SELECT COUNT(*) FROM messages WHERE messages.conversation_id = sessions.conversation_id)
+                                         FROM sessions WHERE session_id = ?''', (session_id,))
+        if not row:
+            conversation = cls(session_id)
+            conversation.save_session_to_db()
+            return conversation
+        conversation_id, message_count = row[0]
+        if current is not None and (current.conversation_id, current.message_count) == (conversation_id, message_count):
+            return current
 
-        conn.commit()
-        conn.close()
+        conversation = cls(session_id, conversation_id)
+        conversation.user_message_count = conversation_store.read(
+            session_id, "SELECT COUNT(*) FROM messages WHERE conversation_id = ? AND role = 'user'", (conversation_id,))[0][0]
+        history = conversation_store.read(
+            session_id, "SELECT role, content, name FROM messages WHERE conversation_id = ? ORDER BY rowid DESC LIMIT ?",
+            (conversation_id, MAX_CONVERSATION_HISTORY))
+        for role, content, name in reversed(history):
+            message = {"role": role, "content": content}
+            if name:
+                message["name"] = name
+            conversation.messages.append(message)
+        conversation.message_count = message_count
+        return conversation
 
     def is_conversation_limit_reached(self):
         return self.user_message_count >= MAX_USER_MESSAGES
 
     def reset(self):
-        self.__init__()
+        self.__init__(self.session_id)
+        self.save_session_to_db()
 
-conversation = Conversation()
+class Session:
+    __slots__ = ("conversation", "lock", "users", "last_used")
 
-def get_part_or_model_info(*query_items):
-    print(f"Calling get_part_or_model_info function with query items: {query_items}")
-    results = {}
-    for item in query_items[:MAX_PARTS_PER_QUERY]:
+    def __init__(self):
+        self.conversation = None
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.last_used = time.monotonic()
+
+class SessionStore:
+    """
+    Live conversations keyed by session ID. Turns on one session are serialized by its lock
+    within this process and by its lease in conversations.db across worker processes, while
+    different sessions run in parallel. The store is bounded by LRU and idle-timeout eviction;
+    evicted (or never seen) sessions are rehydrated from conversations.db on their next turn,
+    which is also how several worker processes share them.
+    """
+    def __init__(self, max_sessions, idle_timeout):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()
+
+    @asynccontextmanager
+    async def session(self, session_id):
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            entry = self.sessions[session_id] = Session()
+        self.sessions.move_to_end(session_id)
+        entry.users += 1
         try:
-            result = search_item(item)
-            if isinstance(result, dict):
-                if result.get('type') == 'error':
-                    results[item] = result
-                elif result.get('type') == 'model':
-                    results[item] = {
-                        "type": "model",
-                        "model_name": result.get('model_name', 'Unknown Model'),
-                        "model_url": result.get('model_url', ''),
-                        "manuals": [f"{{{{display:manual|{manual.get('url', '')}|{manual.get('title', 'Manual')}}}}}" for manual in result.get('manuals', [])],
-                        "diagrams": [f"{{{{display:diagram|{diagram.get('url', '')}|{diagram.get('title', 'Diagram')}}}}}" for diagram in result.get('diagrams', [])],
-                        "videos": [f"{{{{display:video|{video.get('url', '')}|{video.get('title', 'Video')}}}}}" for video in result.get('videos', [])],
-                        "parts_url": result.get('parts_url', '')
-                    }
-                elif result.get('type') == 'part':
-                    results[item] = {
-                        "type": "part",
-                        "part_number": result.get('part_number', 'Unknown Part'),
-                        "part_url": result.get('part_url', ''),
-                        "image": f"{{{{display:image|{result.get('image_url', '')}|{result.get('part_number', 'Part Image')}}}}}",
-                        "product_description": result.get('product_description', ''),
-                        "symptoms_it_fixes": result.get('symptoms_it_fixes', ''),
-                        "appliances_its_for": result.get('appliances_its_for', ''),
-                        "compatible_brands": result.get('compatible_brands', ''),
-                        "installation_video": f"{{{{display:video|{result.get('installation_video', '')}|Installation Video}}}}" if result.get('installation_video') != "No installation video available" else '',
-                        "price": result.get('price', 'Price not available'),
-                        "availability": result.get('availability', 'Availability not specified'),
-                        "ps_number": result.get('ps_number', 'PartSelect Number not available'),
-                        "mfg_number": result.get('mfg_number', 'Manufacturer Part Number not available'),
-                        "installation_difficulty": result.get('installation_difficulty', 'Unknown'),
-                        "installation_time": result.get('installation_time', 'Unknown'),
-                        "review_count": result.get('review_count', 'No reviews'),
-                        "rating": result.get('rating', 'No rating')
-                    }
-                else:
-                    results[item] = result
-            else:
-                results[item] = {
-                    "type": "error",
-                    "error": f"Unexpected result type for item {item}"
+            async with entry.lock, conversation_store.lease(session_id):
+                with span("session_load"):
+                    entry.conversation = await asyncio.to_thread(Conversation.load, session_id, entry.conversation)
+                yield entry.conversation
+        finally:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            self.evict()
+
+    def evict(self):
+        now = time.monotonic()
+        for session_id, entry in list(self.sessions.items()):
+            if len(self.sessions) <= self.max_sessions and now - entry.last_used < self.idle_timeout:
+                break  # the rest were used more recently
+            if entry.users == 0:
+                del self.sessions[session_id]
+
+session_store = SessionStore(SESSION_STORE_MAX_SESSIONS, SESSION_IDLE_TIMEOUT)
+
+async def get_part_or_model_info(*query_items):
+    logger.debug("Calling get_part_or_model_info function with query items: %s", query_items)
+    items = query_items[:MAX_PARTS_PER_QUERY]
+    semaphore = asyncio.Semaphore(ITEM_LOOKUP_CONCURRENCY)
+
+    async def bounded_lookup(item):
+        async with semaphore:
+            return await get_item_info(item)
+
+    # gather preserves input order, so results and per-item errors line up with query_items
+    item_infos = await asyncio.gather(*(bounded_lookup(item) for item in items))
+
+    results = {}
+    for item, item_info in zip(items, item_infos):
+        results[item] = item_info
+    return results
+
+async def get_item_info(item):
+    try:
+        result = await search_item(item)
+        if isinstance(result, dict):
+            if result.get('type') == 'error':
+                return result
+            elif result.get('type') == 'model':
+                return {
+                    "type": "model",
+                    "model_name": result.get('model_name', 'Unknown Model'),
+                    "model_url": result.get('model_url', ''),
+                    "manuals": [f"{{{{display:manual|{manual.get('url', '')}|{manual.get('title', 'Manual')}}}}}" for manual in result.get('manuals', [])],
+                    "diagrams": [f"{{{{display:diagram|{diagram.get('url', '')}|{diagram.get('title', 'Diagram')}}}}}" for diagram in result.get('diagrams', [])],
+                    "videos": [f"{{{{display:video|{video.get('url', '')}|{video.get('title', 'Video')}}}}}" for video in result.get('videos', [])],
+                    "parts_url": result.get('parts_url', '')
                 }
-        except Exception as e:
-            print(f"Error processing item {item}: {str(e)}")
-            results[item] = {
+            elif result.get('type') == 'part':
+                return {
+                    "type": "part",
+                    "part_number": result.get('part_number', 'Unknown Part'),
+                    "part_url": result.get('part_url', ''),
+                    "image": f"{{{{display:image|{result.get('image_url', '')}|{result.get('part_number', 'Part Image')}}}}}",
+                    "product_description": result.get('product_description', ''),
+                    "symptoms_it_fixes": result.get('symptoms_it_fixes', ''),
+                    "appliances_its_for": result.get('appliances_its_for', ''),
+                    "compatible_brands": result.get('compatible_brands', ''),
+                    "installation_video": f"{{{{display:video|{result.get('installation_video', '')}|Installation Video}}}}" if result.get('installation_video') != "No installation video available" else '',
+                    "price": result.get('price', 'Price not available'),
+                    "availability": result.get('availability', 'Availability not specified'),
+                    "ps_number": result.get('ps_number', 'PartSelect Number not available'),
+                    "mfg_number": result.get('mfg_number', 'Manufacturer Part Number not available'),
+                    "installation_difficulty": result.get('installation_difficulty', 'Unknown'),
+                    "installation_time": result.get('installation_time', 'Unknown'),
+                    "review_count": result.get('review_count', 'No reviews'),
+                    "rating": result.get('rating', 'No rating')
+                }
+            else:
+                return result
+        else:
+            return {
                 "type": "error",
-                "error": f"Failed to process item: {str(e)}"
+                "error": f"Unexpected result type for item {item}"
             }
-    return results
+    except Exception as e:
+        logger.error("Error processing item %s: %s", item, e)
+        return {
+            "type": "error",
+            "error": f"Failed to process item: {str(e)}"
+        }
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+# A letter prefix then a digit (WDT780SAEM1, PS11750057, W10712395), optionally with hyphenated
+# segments that also contain digits (DA97-08006A), or a run of 6+ digits, possibly followed by
+# letters and digits (2188656, 66513593K112); any of them may carry a short regional suffix
+# (RF28HMEDBSR/AA). Hyphenated words ("24-inch", "covid-19") and short numbers ("3rd", "2") don't count.
+ITEM_NUMBER_PATTERN = re.compile(r'\b(?:[A-Z]{1,5}\d[A-Z0-9]*(?:-[A-Z0-9]*\d[A-Z0-9]*)+|[A-Z]{1,5}\d[A-Z0-9]{3,}|\d{6,}[A-Z0-9]*)(?:/[A-Z0-9]{1,4})?\b', re.IGNORECASE)
 
-def search_item(query: str):
-    search_url = f"https://www.partselect.com/api/search/?searchterm={query}"
-    print(f"Searching for item: {query}")
+# Lookups started from the user's message for the current turn, keyed by normalized item number
+speculative_lookups = contextvars.ContextVar("speculative_lookups", default=None)
+
+def extract_item_numbers(text: str):
+    numbers = []
+    for match in ITEM_NUMBER_PATTERN.finditer(text):
+        number = normalize_part_number(match.group())
+        if number not in numbers:
+            numbers.append(number)
+    return numbers[:MAX_PARTS_PER_QUERY]
+
+def start_speculative_lookups(user_query: str):
+    """
+    Start looking up part and model numbers in the user's message while the tool-selection
+    completion runs; search_item hands them to the tool call that asks for the same item.
+    """
+    lookups = {}
+    if PREFETCH_ENABLED:
+        for number in extract_item_numbers(user_query):
+            lookups[number] = asyncio.ensure_future(speculative_lookup(number))
+        if lookups:
+            logger.debug("Prefetching %s", ", ".join(lookups))
+    speculative_lookups.set(lookups)
+    return lookups
+
+async def speculative_lookup(number):
+    speculative_fetch.set(True)  # the lookup runs in its own task, so this stays within it
+    return await lookup_item(number)
+
+def drop_speculative_lookups(lookups):
+    # Whatever no tool asked for is cancelled, along with any scrape no other request is waiting on;
+    # lookups that already finished stay in the scrape cache
+    for task in lookups.values():
+        PREFETCH_LOOKUPS.labels("unused").inc()
+        task.cancel()
+    lookups.clear()
+
+async def search_item(query: str):
+    lookups = speculative_lookups.get()
+    task = lookups.pop(normalize_part_number(query), None) if lookups else None
+    if task is not None:
+        PREFETCH_LOOKUPS.labels("used").inc()
+        logger.debug("Using prefetched lookup for %s", query)
+        return await task
+    return await lookup_item(query)
+
+async def lookup_item(query: str):
+    search_url = f"{PARTSELECT_BASE_URL}/api/search/?searchterm={query}"
+    logger.debug("Searching for item: %s", query)
     
     try:
-        search_response = requests.get(search_url, allow_redirects=True)
-        search_response.raise_for_status()
+        if CATALOG_LOCAL_FIRST:
+            record = await asyncio.to_thread(catalog.find_item, query)
+            if record is not None:
+                logger.debug("Answered %s from the catalog", query)
+                if record.get("type") == "part":
+                    # Records saved before volatile fields were left out may still carry crawl-time prices
+                    record = {field: value for field, value in record.items() if field not in CATALOG_VOLATILE_FIELDS}
+                    [record] = await add_current_prices([record])
+                return record
+
+        # The search redirect for a given part or model number rarely changes, so it is cached separately
+        resolved_url = await scrape_cache.get_or_fetch("search", query.strip().upper(), lambda: resolve_search_url(search_url))
         
-        if '/Models/' in search_response.url:
-            return search_model(search_response.url)
-        elif 'PS' in search_response.url:
-            return search_part(search_response.url)
+        if '/Models/' in resolved_url:
+            return await search_model(resolved_url)
+        elif 'PS' in resolved_url:
+            return await search_part(resolved_url)
         else:
-            print(f"Item {query} not found")
+            logger.warning("Item %s not found", query)
             return {"error": f"Item {query} not found"}
 
-    except requests.RequestException as e:
-        print(f"Error fetching item info: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error fetching item info: %s", e)
         return {"error": f"Failed to fetch data: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.exception("Unexpected error: %s", e)
         return {"error": f"An unexpected error occurred: {str(e)}"}
 
-def search_part(part_url: str):
-    print(f"Searching part URL: {part_url}")
+async def resolve_search_url(search_url: str):
+    search_response = await fetch(search_url)
+    return str(search_response.url)
+
+async def search_part(part_url: str):
+    return await scrape_cache.get_or_fetch("part", normalize_url(part_url), lambda: scrape_part(part_url))
+
+def parse_part_page(html, part_url):
+    # Part details are spread across the page, so it is parsed whole (with the C-backed parser when available)
+    soup = make_soup(html)
     
-    try:
-        response = requests.get(part_url)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        image_url = None
-        main_image_container = soup.find('div', class_='main-image-container')
-        if main_image_container:
-            image_link = main_image_container.find('a', id='MagicZoom-PartImage-Images')
-            if image_link:
-                image_url = image_link.get('href')
-        
-        if not image_url:
-            thumbnails = soup.find('div', class_='pd__img__thumbs')
-            if thumbnails:
-                first_thumbnail = thumbnails.find('a', class_='js-part-img-thumb')
-                if first_thumbnail:
-                    image_url = first_thumbnail.get('href')
-        
-        product_description = soup.find('div', {'class': 'pd__description'})
-        product_description = product_description.text.strip() if product_description else "No description available."
-        
-        troubleshooting_section = soup.select_one('.pd__wrap.row')
-        symptoms_it_fixes = ""
-        appliances_its_for = ""
-        compatible_brands = ""
+    image_url = None
+    main_image_container = soup.find('div', class_='main-image-container')
+    if main_image_container:
+        image_link = main_image_container.find('a', id='MagicZoom-PartImage-Images')
+        if image_link:
+            image_url = image_link.get('href')
+    
+    if not image_url:
+        thumbnails = soup.find('div', class_='pd__img__thumbs')
+        if thumbnails:
+            first_thumbnail = thumbnails.find('a', class_='js-part-img-thumb')
+            if first_thumbnail:
+                image_url = first_thumbnail.get('href')
+    
+    product_description = soup.find('div', {'class': 'pd__description'})
+    product_description = product_description.text.strip() if product_description else "No description available."
+    
+    troubleshooting_section = soup.select_one('.pd__wrap.row')
+    symptoms_it_fixes = ""
+    appliances_its_for = ""
+    compatible_brands = ""
 
-        if troubleshooting_section:
-            sections = troubleshooting_section.find_all('div', class_='col-md-6 mt-3')
+    if troubleshooting_section:
+        sections = troubleshooting_section.find_all('div', class_='col-md-6 mt-3')
+        
+        for section in sections:
+            title = section.find('div', class_='bold mb-1').get_text(strip=True)
+            content = section.find('div', {'data-collapse-container': True})
             
-            for section in sections:
-                title = section.find('div', class_='bold mb-1').get_text(strip=True)
-                content = section.find('div', {'data-collapse-container': True})
-                
-                if content:
-                    content = content.get_text(strip=True)
+            if content:
+                content = content.get_text(strip=True)
+            else:
+                content = section.contents[-1].strip()
+
+            if "fixes the following symptoms" in title.lower():
+                symptoms_it_fixes = content
+            elif "works with the following products" in title.lower():
+                if not appliances_its_for:
+                    appliances_its_for = content
                 else:
-                    content = section.contents[-1].strip()
-
-                if "fixes the following symptoms" in title.lower():
-                    symptoms_it_fixes = content
-                elif "works with the following products" in title.lower():
-                    if not appliances_its_for:
-                        appliances_its_for = content
-                    else:
-                        compatible_brands = content
-        
-        videos = soup.find_all('div', {'class': 'yt-video'})
-        installation_video = next((video for video in videos if "How Buying OEM Parts" not in video.find('img')['title']), None)
-        video_link = f"https://www.youtube.com/watch?v={installation_video['data-yt-init']}" if installation_video else "No installation video available"
-        
-        price_element = soup.find('span', {'class': 'price pd__price'})
-        price = price_element.text.strip() if price_element else "Price not available"
-        
-        availability_element = soup.find('div', {'class': 'js-partAvailability'})
-        availability = availability_element.text.strip() if availability_element else "Availability not specified"
-        
-        ps_number = soup.find(itemprop="productID")
-        ps_number = ps_number.text.strip() if ps_number else "PartSelect Number not available"
-        
-        mfg_number = soup.find(itemprop="mpn")
-        mfg_number = mfg_number.text.strip() if mfg_number else "Manufacturer Part Number not available"
-        
-        repair_rating_section = soup.select_one('.pd__repair-rating')
-        installation_difficulty = "Unknown"
-        installation_time = "Unknown"
-
-        if repair_rating_section:
-            installation_difficulty_element = repair_rating_section.select_one('.d-flex p.bold')
-            if installation_difficulty_element:
-                installation_difficulty = installation_difficulty_element.text.strip()
-
-            installation_time_element = repair_rating_section.select('.d-flex p.bold')[1] if len(repair_rating_section.select('.d-flex p.bold')) > 1 else None
-            if installation_time_element:
-                installation_time = installation_time_element.text.strip()
+                    compatible_brands = content
+    
+    videos = soup.find_all('div', {'class': 'yt-video'})
+    installation_video = next((video for video in videos if "How Buying OEM Parts" not in video.find('img')['title']), None)
+    video_link = f"https://www.youtube.com/watch?v={installation_video['data-yt-init']}" if installation_video else "No installation video available"
+    
+    price_element = soup.find('span', {'class': 'price pd__price'})
+    price = price_element.text.strip() if price_element else "Price not available"
+    
+    availability_element = soup.find('div', {'class': 'js-partAvailability'})
+    availability = availability_element.text.strip() if availability_element else "Availability not specified"
+    
+    ps_number = soup.find(itemprop="productID")
+    ps_number = ps_number.text.strip() if ps_number else "PartSelect Number not available"
+    
+    mfg_number = soup.find(itemprop="mpn")
+    mfg_number = mfg_number.text.strip() if mfg_number else "Manufacturer Part Number not available"
+    
+    repair_rating_section = soup.select_one('.pd__repair-rating')
+    installation_difficulty = "Unknown"
+    installation_time = "Unknown"
+
+    if repair_rating_section:
+        installation_difficulty_element = repair_rating_section.select_one('.d-flex p.bold')
+        if installation_difficulty_element:
+            installation_difficulty = installation_difficulty_element.text.strip()
+
+        installation_time_element = repair_rating_section.select('.d-flex p.bold')[1] if len(repair_rating_section.select('.d-flex p.bold')) > 1 else None
+        if installation_time_element:
+            installation_time = installation_time_element.text.strip()
+    
+    review_section = soup.find('a', class_='bold no-underline js-scrollTrigger', href='#CustomerReviews')
+    review_count = "No reviews"
+    rating = "No rating"
+    if review_section:
+        review_count_element = review_section.find('span', class_='rating__count')
+        if review_count_element:
+            review_count = review_count_element.text.strip()
         
-        review_section = soup.find('a', class_='bold no-underline js-scrollTrigger', href='#CustomerReviews')
-        review_count = "No reviews"
-        rating = "No rating"
-        if review_section:
-            review_count_element = review_section.find('span', class_='rating__count')
-            if review_count_element:
-                review_count = review_count_element.text.strip()
-            
-            rating_element = review_section.find('div', class_='rating__stars__upper')
-            if rating_element and 'style' in rating_element.attrs:
-                width_str = rating_element['style']
-                width_percentage = float(width_str.split(':')[1].strip().rstrip('%'))
-                rating = round(width_percentage / 20, 1)
+        rating_element = review_section.find('div', class_='rating__stars__upper')
+        if rating_element and 'style' in rating_element.attrs:
+            width_str = rating_element['style']
+            width_percentage = float(width_str.split(':')[1].strip().rstrip('%'))
+            rating = round(width_percentage / 20, 1)
+    
+    part_info = {
+        "type": "part",
+        "part_number": ps_number,
+        "part_url": part_url,
+        "image_url": image_url,
+        "product_description": product_description,
+        "symptoms_it_fixes": symptoms_it_fixes,
+        "appliances_its_for": appliances_its_for,
+        "compatible_brands": compatible_brands,
+        "installation_video": video_link,
+        "price": price,
+        "availability": availability,
+        "ps_number": ps_number,
+        "mfg_number": mfg_number,
+        "installation_difficulty": installation_difficulty,
+        "installation_time": installation_time,
+        "review_count": review_count,
+        "rating": rating
+    }
+    
+    return part_info
+
+async def scrape_part(part_url: str):
+    logger.debug("Searching part URL: %s", part_url)
+    
+    try:
+        response = await fetch(part_url)
         
-        part_info = {
-            "type": "part",
-            "part_number": ps_number,
-            "part_url": part_url,
-            "image_url": image_url,
-            "product_description": product_description,
-            "symptoms_it_fixes": symptoms_it_fixes,
-            "appliances_its_for": appliances_its_for,
-            "compatible_brands": compatible_brands,
-            "installation_video": video_link,
-            "price": price,
-            "availability": availability,
-            "ps_number": ps_number,
-            "mfg_number": mfg_number,
-            "installation_difficulty": installation_difficulty,
-            "installation_time": installation_time,
-            "review_count": review_count,
-            "rating": rating
-        }
+        part_info = await asyncio.to_thread(parse_part_page, response.text, part_url)
+        await part_search_index.record_details(part_info)
         
-        print(f"Retrieved information for part:")
-        print(json.dumps(part_info, indent=2))
+        log_payload("Retrieved information for part", part_info)
         
         return part_info
     
-    except requests.RequestException as e:
-        print(f"Error fetching part info: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error fetching part info: %s", e)
         return {"error": f"Failed to fetch data: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.exception("Unexpected error: %s", e)
         return {"error": f"An unexpected error occurred: {str(e)}"}
 
-def check_compatibility(model_number: str, part_number: str):
-    print(f"Checking compatibility between model {model_number} and part {part_number}")
+async def check_compatibility(model_number: str, part_number: str):
+    logger.debug("Checking compatibility between model %s and part %s", model_number, part_number)
     
     try:
-        model_url = f"https://www.partselect.com/Models/{model_number}/"
-        parts = get_all_parts(model_url)
+        model_url = f"{PARTSELECT_BASE_URL}/Models/{model_number}/"
         
-        is_compatible = any(
-            (part.get('ps_number') == part_number) or (part.get('mfg_number') == part_number)
-            for part in parts
-        )
+        def find_part(cards):
+            card = next((card for card in cards if card.matches(part_number)), None)
+            return card.to_dict() if card else None
         
-        compatible_part = next(
-            (part for part in parts if part.get('ps_number') == part_number or part.get('mfg_number') == part_number),
-            None
-        )
+        is_compatible, compatible_part = compatibility_index.lookup(model_number, part_number)
+        if is_compatible is None:
+            parts_key = normalize_url(urljoin(model_url, 'Parts/'))
+            cached_parts = await scrape_cache.peek("parts_list", parts_key)
+            full_crawl = scrape_cache.in_flight.running(f"parts_list:{parts_key}") if cached_parts is None else None
+            if full_crawl is not None:
+                # A get_all_parts crawl of this model is already running; its result settles the check
+                cached_parts = await asyncio.shield(full_crawl)
+                if isinstance(cached_parts, dict):
+                    return cached_parts
+            if cached_parts is not None:
+                compatible_part = find_part(PartCard.from_dict(part_info) for part_info in cached_parts)
+            else:
+                # Stop reading as soon as the part shows up on any page
+                compatible_part = None
+                async with ModelPartsCrawl.join(model_url) as pages:
+                    async for page_parts in pages:
+                        compatible_part = find_part(page_parts)
+                        if compatible_part:
+                            break
         
-        print(f"Compatibility result: {'Compatible' if is_compatible else 'Not compatible'}")
+            is_compatible = compatible_part is not None
+        
+        logger.debug("Compatibility result: %s", 'Compatible' if is_compatible else 'Not compatible')
         if compatible_part:
-            print(f"Compatible part found: {compatible_part}")
+            logger.debug("Compatible part found: %s", compatible_part)
         else:
-            print(f"No compatible part found for {part_number}")
+            logger.debug("No compatible part found for %s", part_number)
         
         return {
             "is_compatible": is_compatible,
@@ -375,123 +1728,472 @@ def check_compatibility(model_number: str, part_number: str):
             "compatible_part": compatible_part
         }
     
-    except requests.RequestException as e:
-        print(f"Error checking compatibility: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error checking compatibility: %s", e)
         return {"error": f"Failed to fetch data: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error in check_compatibility: {e}")
+        logger.exception("Unexpected error in check_compatibility: %s", e)
         return {"error": f"An unexpected error occurred: {str(e)}"}
 
-def get_all_parts(model_url: str):
-    parts = []
+BULK_MODEL_CONCURRENCY = int(os.getenv("BULK_MODEL_CONCURRENCY", 4))
+BULK_MAX_PAIRS = int(os.getenv("BULK_MAX_PAIRS", 10000))
+# /compatibility/bulk is disabled unless this is set, and then needs "Authorization: Bearer <token>"
+BULK_API_TOKEN = os.getenv("BULK_API_TOKEN")
+# Shared by every bulk request, so concurrent jobs together crawl at most this many models at once
+bulk_crawl_semaphore = asyncio.Semaphore(BULK_MODEL_CONCURRENCY)
+
+async def check_model_compatibility(model_number: str, part_numbers):
+    """Check several parts against one model, crawling its parts list at most once."""
+    background_fetch.set(True)  # each model is checked in its own task, so this stays within it
+    model_url = f"{PARTSELECT_BASE_URL}/Models/{model_number}/"
     parts_url = urljoin(model_url, 'Parts/')
-    
-    while parts_url:
+
+    def result(part_number, compatible_part):
+        return {
+            "is_compatible": compatible_part is not None,
+            "model_number": model_number,
+            "part_number": part_number,
+            "parts_url": parts_url,
+            "compatible_part": compatible_part
+        }
+
+    results = []
+    unresolved = []
+    for part_number in part_numbers:
+        is_compatible, compatible_part = compatibility_index.lookup(model_number, part_number)
+        if is_compatible is None:
+            unresolved.append(part_number)
+        else:
+            results.append(result(part_number, compatible_part))
+
+    if unresolved:
         try:
-            print(f"Fetching parts from: {parts_url}")
-            response = requests.get(parts_url)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            part_items = soup.find_all('div', class_='mega-m__part')
-            
-            for item in part_items:
-                part_info = {}
-                
-                ps_match = re.search(r'PartSelect #:\s*(PS\d+)', item.text)
-                if ps_match:
-                    part_info['ps_number'] = ps_match.group(1)
-                
-                mfg_match = re.search(r'Manufacturer #:\s*(\S+)', item.text)
-                if mfg_match:
-                    part_info['mfg_number'] = mfg_match.group(1)
-                
-                part_link = item.find('a', class_='bold mb-1 mega-m__part__name')
-                if part_link and 'href' in part_link.attrs:
-                    part_info['url'] = urljoin(parts_url, part_link['href'])
-                
-                if part_info:
-                    parts.append(part_info)
-                    print(f"Debug: Found part: {part_info}")
-            
-            print(f"Parts found on this page: {len(part_items)}")
-            
-            next_page = soup.find('li', class_='next')
-            if next_page:
-                next_link = next_page.find('a')
-                if next_link and 'href' in next_link.attrs:
-                    parts_url = urljoin(parts_url, next_link['href'])
-                    print(f"Next page URL: {parts_url}")
+            async with bulk_crawl_semaphore:
+                parts = await get_all_parts(model_url)
+        except Exception as e:
+            logger.exception("Unexpected error crawling parts for model %s: %s", model_number, e)
+            parts = {"error": f"An unexpected error occurred: {str(e)}"}
+        if isinstance(parts, dict):
+            results.extend({"model_number": model_number, "part_number": part_number, "error": parts.get("error")} for part_number in unresolved)
+        else:
+            cards = [PartCard.from_dict(part_info) for part_info in parts]
+            for part_number in unresolved:
+                card = next((card for card in cards if card.matches(part_number)), None)
+                results.append(result(part_number, card.to_dict() if card else None))
+    return results
+
+async def check_compatibility_bulk(pairs):
+    """
+    Check many (model_number, part_number) pairs without the LLM. Pairs are grouped by model so
+    each parts list is crawled once, models are checked concurrently under bulk_crawl_semaphore,
+    and results are yielded per model as soon as it finishes, in completion order.
+    """
+    part_numbers_by_model = {}
+    for model_number, part_number in pairs:
+        part_numbers = part_numbers_by_model.setdefault(normalize_part_number(model_number), [])
+        if normalize_part_number(part_number) not in part_numbers:
+            part_numbers.append(normalize_part_number(part_number))
+
+    tasks = [asyncio.ensure_future(check_model_compatibility(model_number, part_numbers))
+             for model_number, part_numbers in part_numbers_by_model.items()]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            for result in await finished:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+PS_NUMBER_PATTERN = re.compile(r'PartSelect #:\s*(PS\d+)')
+MFG_NUMBER_PATTERN = re.compile(r'Manufacturer #:\s*(\S+)')
+
+# Fields each tool returns for a part card, in output order
+PARTS_LIST_FIELDS = ('ps_number', 'mfg_number', 'url')
+PART_SEARCH_FIELDS = ('name', 'url', 'ps_number', 'mfg_number', 'price', 'availability', 'image_url')
+
+class PartCard:
+    """A part card from a model's parts listing or part search, turned into a dict only at the tool boundary."""
+    __slots__ = PART_SEARCH_FIELDS
+
+    def __init__(self, name=None, url=None, ps_number=None, mfg_number=None, price=None, availability=None, image_url=None):
+        self.name = name
+        self.url = url
+        self.ps_number = ps_number
+        self.mfg_number = mfg_number
+        self.price = price
+        self.availability = availability
+        self.image_url = image_url
+
+    @property
+    def key(self):
+        return self.ps_number or self.mfg_number or self.url
+
+    def matches(self, part_number):
+        return self.ps_number == part_number or self.mfg_number == part_number
+
+    def to_dict(self, fields=PARTS_LIST_FIELDS):
+        part_info = {}
+        for field in fields:
+            value = getattr(self, field)
+            if value is not None:
+                part_info[field] = value
+        return part_info
+
+    @classmethod
+    def from_dict(cls, part_info):
+        return cls(**{field: part_info.get(field) for field in PART_SEARCH_FIELDS})
+
+def extract_card_image_url(item):
+    image_container = item.find('a', class_='mega-m__part__img')
+    picture_element = image_container.find('picture') if image_container else None
+    if not picture_element:
+        return "Image not available"
+
+    # Prefer the first (1x) URL from the webp data-srcset, then jpeg, then the lazy-loaded img
+    for image_type in ('image/webp', 'image/jpeg'):
+        source = picture_element.find('source', type=image_type)
+        if source and 'data-srcset' in source.attrs:
+            return source['data-srcset'].split(',')[0].strip().split()[0]
+
+    img_element = picture_element.find('img')
+    if img_element and 'data-src' in img_element.attrs:
+        return img_element['data-src']
+    return "Image not available"
+
+def extract_part_card(item, page_url, details=False):
+    # .text rebuilds the card's text on every access, so it is computed once per card
+    text = item.get_text()
+    card = PartCard()
+
+    ps_match = PS_NUMBER_PATTERN.search(text)
+    if ps_match:
+        card.ps_number = ps_match.group(1)
+
+    mfg_match = MFG_NUMBER_PATTERN.search(text)
+    if mfg_match:
+        card.mfg_number = mfg_match.group(1)
+
+    part_link = item.find('a', class_='bold mb-1 mega-m__part__name')
+    if part_link:
+        if 'href' in part_link.attrs:
+            card.url = urljoin(page_url, part_link['href'])
+        # The name is cheap next to the link, and model crawls need it for the part search index
+        card.name = part_link.get_text().strip()
+
+    if details:
+        price_element = item.find('div', class_='mega-m__part__price')
+        if price_element:
+            card.price = price_element.get_text().strip()
+
+        availability_element = item.find('div', class_='mega-m__part__avlbl')
+        if availability_element:
+            card.availability = availability_element.get_text().strip()
+
+        card.image_url = extract_card_image_url(item)
+
+    return card
+
+def parse_parts_page(soup, page_url, details=False):
+    part_items = soup.find_all('div', class_='mega-m__part')
+    cards = [extract_part_card(item, page_url, details) for item in part_items]
+    logger.debug("Parts found on this page: %s", len(part_items))
+    return cards
+
+def find_next_page_url(soup, page_url):
+    next_page = soup.find('li', class_='next')
+    next_link = next_page.find('a') if next_page else None
+    if next_link and 'href' in next_link.attrs:
+        return urljoin(page_url, next_link['href'])
+    return None
+
+def find_page_urls(soup, page_url):
+    """
+    Work out the URLs of the listing pages that follow page_url from its pagination links.
+    Returns [] on the last page, or None when the page URL pattern can't be detected.
+    """
+    next_url = find_next_page_url(soup, page_url)
+    if not next_url:
+        return []
+
+    next_split = urlsplit(next_url)
+    next_params = parse_qsl(next_split.query)
+    current_params = dict(parse_qsl(urlsplit(page_url).query))
+
+    # The page parameter is the numeric query parameter that changes between this page and the next one
+    page_params = [key for key, value in next_params if value.isdigit() and current_params.get(key) != value]
+    if len(page_params) != 1:
+        return None
+    page_param = page_params[0]
+    next_value = int(dict(next_params)[page_param])
+
+    page_values = {next_value}
+    for link in soup.find_all('a', href=True):
+        link_split = urlsplit(urljoin(page_url, link['href']))
+        if link_split.path != next_split.path:
+            continue
+        value = dict(parse_qsl(link_split.query)).get(page_param, '')
+        if value.isdigit() and int(value) >= next_value:
+            page_values.add(int(value))
+    page_values = sorted(page_values)
+
+    if len(page_values) == 1:
+        return [next_url]
+
+    # Works for page numbers (2, 3, 4...) as well as item offsets (31, 61, 91...)
+    step = page_values[1] - page_values[0]
+    if any((value - next_value) % step for value in page_values):
+        return None
+
+    def page_url_for(value):
+        params = [(key, str(value) if key == page_param else param_value) for key, param_value in next_params]
+        return urlunsplit(next_split._replace(query=urlencode(params)))
+
+    return [page_url_for(value) for value in range(next_value, page_values[-1] + 1, step)]
+
+async def iter_listing_pages(start_url: str):
+    """
+    Yield (page_url, soup) for each page of a paginated listing, in page order.
+    Pages after the first are fetched concurrently when the pagination pattern can be
+    detected; closing the generator early cancels any fetches still in flight.
+    A failed page fetch raises, so callers can tell a partial listing from a complete one.
+    """
+    visited_urls = {start_url}
+    semaphore = asyncio.Semaphore(PARTS_PAGE_CONCURRENCY)
+
+    async def fetch_page(page_url):
+        async with semaphore:
+            logger.debug("Fetching listing page: %s", page_url)
+            response = await fetch(page_url)
+            return await asyncio.to_thread(make_soup, response.text, PARTS_LISTING_STRAINER)
+
+    page_url = start_url
+    soup = await fetch_page(page_url)
+    yield page_url, soup
+
+    while True:
+        page_urls = find_page_urls(soup, page_url)
+        if page_urls is None:
+            # Unknown pagination pattern, fall back to walking li.next one page at a time
+            page_url = find_next_page_url(soup, page_url)
+            if not page_url or page_url in visited_urls:
+                return
+            logger.debug("Next page URL: %s", page_url)
+            visited_urls.add(page_url)
+            soup = await fetch_page(page_url)
+            yield page_url, soup
+            continue
+
+        page_urls = [url for url in page_urls if url not in visited_urls]
+        if not page_urls:
+            logger.debug("No more pages")
+            return
+        visited_urls.update(page_urls)
+
+        logger.debug("Fetching %s more listing pages concurrently", len(page_urls))
+        tasks = [asyncio.ensure_future(fetch_page(url)) for url in page_urls]
+        try:
+            for url, task in zip(page_urls, tasks):
+                yield url, await task
+        finally:
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    task.exception()
+                task.cancel()
+
+        # Pagination may only link a window of pages, so keep going from the last page fetched
+        page_url, soup = page_urls[-1], tasks[-1].result()
+
+async def iter_model_parts(model_url: str):
+    """Yield the PartCards of a model page by page, de-duplicated by PS number across pages."""
+    seen_keys = set()
+    async with aclosing(iter_listing_pages(urljoin(model_url, 'Parts/'))) as pages:
+        async for page_url, soup in pages:
+            page_parts = []
+            for card in parse_parts_page(soup, page_url):
+                key = card.key
+                if key and key not in seen_keys:
+                    seen_keys.add(key)
+                    page_parts.append(card)
+            yield page_parts
+
+# Normalized Parts/ URL -> the ModelPartsCrawl currently reading it
+model_parts_crawls = {}
+model_parts_crawl_tasks = set()
+
+class ModelPartsCrawl:
+    """
+    One model's paged parts crawl shared by concurrent compatibility checks. Pages are kept as
+    they arrive so a check joining late replays them, and the crawl stops once no check is still
+    reading. It is recorded in the compatibility index as complete only if it reached the last page.
+    """
+    def __init__(self, model_url, key):
+        self.model_url = model_url
+        self.key = key
+        self.pages = []
+        self.finished = False
+        self.error = None
+        self.readers = 0
+        self.changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self.run())
+        model_parts_crawl_tasks.add(self.task)
+        self.task.add_done_callback(model_parts_crawl_tasks.discard)
+
+    @classmethod
+    @asynccontextmanager
+    async def join(cls, model_url):
+        key = normalize_url(urljoin(model_url, 'Parts/'))
+        crawl = model_parts_crawls.get(key)
+        if crawl is None:
+            crawl = model_parts_crawls[key] = cls(model_url, key)
+        else:
+            scrape_cache.in_flight.coalesced += 1
+        crawl.readers += 1
+        try:
+            async with aclosing(crawl.read()) as pages:
+                yield pages
+        finally:
+            crawl.readers -= 1
+
+    def detach(self):
+        # Checks arriving from now on start a new crawl rather than read a stopped one
+        if model_parts_crawls.get(self.key) is self:
+            del model_parts_crawls[self.key]
+
+    async def run(self):
+        parts = []
+        crawl_complete = False
+        try:
+            async with aclosing(iter_model_parts(self.model_url)) as pages:
+                async for page_parts in pages:
+                    parts.extend(page_parts)
+                    async with self.changed:
+                        self.pages.append(page_parts)
+                        self.changed.notify_all()
+                    if not self.readers:
+                        self.detach()
+                        break
                 else:
-                    print("No more pages")
-                    parts_url = None
-            else:
-                print("No next page found")
-                parts_url = None
+                    crawl_complete = True
         except Exception as e:
-            print(f"Error fetching parts: {e}")
-            parts_url = None
+            self.error = e
+        finally:
+            self.detach()
+            async with self.changed:
+                self.finished = True
+                self.changed.notify_all()
+
+        model_number = model_number_from_url(self.model_url)
+        await compatibility_index.record(model_number, parts, crawl_complete)
+        if crawl_complete:
+            await part_search_index.record(model_number, parts)
+
+    async def read(self):
+        position = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: position < len(self.pages) or self.finished)
+                if position < len(self.pages):
+                    page_parts = self.pages[position]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            position += 1
+            yield page_parts
+
+async def get_all_parts(model_url: str):
+    parts_url = urljoin(model_url, 'Parts/')
+    return await scrape_cache.get_or_fetch("parts_list", normalize_url(parts_url), lambda: crawl_all_parts(model_url))
+
+async def crawl_all_parts(model_url: str):
+    parts = []
+    crawl_complete = False
+    error = None
+    
+    try:
+        async with aclosing(iter_model_parts(model_url)) as pages:
+            async for page_parts in pages:
+                parts.extend(page_parts)
+        crawl_complete = True
+    except Exception as e:
+        logger.error("Error fetching parts: %s", e)
+        error = e
+    
+    logger.debug("Total parts found: %s", len(parts))
+    await compatibility_index.record(model_number_from_url(model_url), parts, crawl_complete)
+    if not crawl_complete:
+        # A partial list would read as "not compatible" for everything missing from it, so it isn't returned or cached
+        return {"error": f"Failed to fetch the full parts list: {str(error)}"}
+    await part_search_index.record(model_number_from_url(model_url), parts)
+    return [card.to_dict() for card in parts]
+
+def parse_model_page(html, model_url):
+    soup = make_soup(html)
+    
+    model_name = soup.find('h1', {'class': 'title-main'})
+    model_name = model_name.text.strip() if model_name else "Model name not found"
+    
+    manuals = []
+    manual_section = soup.find('div', class_='d-flex flex-wrap mt-2 mb-4')
+    if manual_section:
+        manual_items = manual_section.find_all('a', class_='mega-m__manuals')
+        for item in manual_items:
+            title = item.find('div', class_='mega-m__manuals__title')
+            title = title.text.strip() if title else "Unknown title"
+            url = item.get('href', '')
+            if url:
+                manuals.append({
+                    "title": title,
+                    "url": url
+                })
     
-    print(f"Total parts found: {len(parts)}")
-    return parts
+    diagrams = []
+    diagram_section = soup.find('div', class_='row mb-3')
+    if diagram_section:
+        diagram_items = diagram_section.find_all('a', class_='no-underline d-block')
+        for item in diagram_items:
+            title = item.find('span')
+            title = title.text.strip() if title else "Unknown title"
+            url = item.get('href', '')
+            if url:
+                diagrams.append({
+                    "title": title,
+                    "url": url_join(model_url, url)
+                })
+    
+    return model_name, manuals, diagrams
+
+def parse_videos_page(soup):
+    videos = []
+    video_items = soup.find_all('div', class_='yt-video')
+    for item in video_items:
+        title = item.find('img')
+        title = title['title'] if title and 'title' in title.attrs else "Unknown title"
+        video_id = item.get('data-yt-init')
+        if video_id:
+            videos.append({
+                "title": title,
+                "url": f"https://www.youtube.com/watch?v={video_id}"
+            })
+    return videos
 
-def search_model(model_url: str):
-    print(f"Searching model URL: {model_url}")
+async def search_model(model_url: str):
+    return await scrape_cache.get_or_fetch("model", normalize_url(model_url), lambda: scrape_model(model_url))
+
+async def scrape_model(model_url: str):
+    logger.debug("Searching model URL: %s", model_url)
     
     try:
-        response = requests.get(model_url)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
+        response = await fetch(model_url)
         
-        model_name = soup.find('h1', {'class': 'title-main'})
-        model_name = model_name.text.strip() if model_name else "Model name not found"
-        
-        manuals = []
-        manual_section = soup.find('div', class_='d-flex flex-wrap mt-2 mb-4')
-        if manual_section:
-            manual_items = manual_section.find_all('a', class_='mega-m__manuals')
-            for item in manual_items:
-                title = item.find('div', class_='mega-m__manuals__title')
-                title = title.text.strip() if title else "Unknown title"
-                url = item.get('href', '')
-                if url:
-                    manuals.append({
-                        "title": title,
-                        "url": url
-                    })
-        
-        diagrams = []
-        diagram_section = soup.find('div', class_='row mb-3')
-        if diagram_section:
-            diagram_items = diagram_section.find_all('a', class_='no-underline d-block')
-            for item in diagram_items:
-                title = item.find('span')
-                title = title.text.strip() if title else "Unknown title"
-                url = item.get('href', '')
-                if url:
-                    diagrams.append({
-                        "title": title,
-                        "url": url_join(model_url, url)
-                    })
+        model_name, manuals, diagrams = await asyncio.to_thread(parse_model_page, response.text, model_url)
         
         videos = []
         videos_url = url_join(model_url, 'Videos/')
         while videos_url:
-            videos_response = requests.get(videos_url)
-            videos_response.raise_for_status()
-            videos_soup = BeautifulSoup(videos_response.text, 'html.parser')
-            video_items = videos_soup.find_all('div', class_='yt-video')
-            for item in video_items:
-                title = item.find('img')
-                title = title['title'] if title and 'title' in title.attrs else "Unknown title"
-                video_id = item.get('data-yt-init')
-                if video_id:
-                    videos.append({
-                        "title": title,
-                        "url": f"https://www.youtube.com/watch?v={video_id}"
-                    })
+            videos_response = await fetch(videos_url)
+            videos_soup = await asyncio.to_thread(make_soup, videos_response.text, VIDEOS_LISTING_STRAINER)
+            videos.extend(parse_videos_page(videos_soup))
             
             next_page = videos_soup.find('li', class_='next')
             next_link = next_page.find('a') if next_page else None
@@ -512,377 +2214,715 @@ def search_model(model_url: str):
             "parts_url": parts_url
         }
         
-        print(f"Retrieved information for model:")
-        print(json.dumps(model_info, indent=2))
+        log_payload("Retrieved information for model", model_info)
         
         return model_info
     
-    except requests.RequestException as e:
-        print(f"Error fetching model info: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error fetching model info: %s", e)
         return {"type": "error", "error": f"Failed to fetch data: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.exception("Unexpected error: %s", e)
         return {"type": "error", "error": f"An unexpected error occurred: {str(e)}"}
     
-def get_repair_info(appliance_type, symptom):
+# The repair symptoms the system prompt offers; each has a page at Repair/<appliance>/<symptom>/
+REPAIR_SYMPTOMS = {
+    "Dishwasher": [
+        "Not Cleaning Properly", "Not Draining", "Noisy", "Leaking", "Will Not Start", "Door Latch Failure",
+        "Will Not Fill Water", "Will Not Dispense Detergent", "Not Drying Properly"
+    ],
+    "Refrigerator": [
+        "Noisy", "Leaking", "Will Not Start", "Not Making Ice", "Refrigerator Too Warm", "Not Dispensing Water",
+        "Refrigerator Freezer Too Warm", "Door Sweating", "Light Not Working", "Refrigerator Too Cold",
+        "Running Too Long", "Freezer Too Cold"
+    ]
+}
+REPAIR_SNAPSHOT_ENABLED = os.getenv("REPAIR_SNAPSHOT_ENABLED", "1") == "1"
+REPAIR_SNAPSHOT_REFRESH_INTERVAL = float(os.getenv("REPAIR_SNAPSHOT_REFRESH_INTERVAL", 6 * 60 * 60))
+REPAIR_SNAPSHOT_CONCURRENCY = 4
+
+# Parsed repair pages for every symptom above, keyed by repair_snapshot_key
+repair_snapshot = {}
+
+def repair_snapshot_key(appliance_type, symptom):
+    return appliance_type.strip().lower(), symptom.strip().lower().replace(' ', '-')
+
+async def refresh_repair_snapshot():
+    semaphore = asyncio.Semaphore(REPAIR_SNAPSHOT_CONCURRENCY)
+
+    async def refresh(appliance_type, symptom):
+        url = f"{PARTSELECT_BASE_URL}/Repair/{appliance_type}/{symptom.replace(' ', '-')}/"
+        async with semaphore:
+            repair_info = await scrape_general_repair_info(url)
+        # A failed refresh keeps the previous snapshot of that page
+        if is_cacheable(repair_info):
+            repair_snapshot[repair_snapshot_key(appliance_type, symptom)] = repair_info
+
+    await asyncio.gather(*(refresh(appliance_type, symptom)
+                           for appliance_type, symptoms in REPAIR_SYMPTOMS.items() for symptom in symptoms))
+    logger.info("Repair snapshot holds %s of %s symptom pages", len(repair_snapshot), sum(map(len, REPAIR_SYMPTOMS.values())))
+
+async def keep_repair_snapshot_fresh():
+    while True:
+        try:
+            await refresh_repair_snapshot()
+        except Exception as e:
+            logger.error("Error refreshing repair snapshot: %s", e)
+        await asyncio.sleep(REPAIR_SNAPSHOT_REFRESH_INTERVAL)
+
+async def get_repair_info(appliance_type, symptom):
+    repair_info = repair_snapshot.get(repair_snapshot_key(appliance_type, symptom))
+    if repair_info is not None:
+        return repair_info
+
     formatted_symptom = symptom.replace(' ', '-')
 
-    general_repair_url = f"https://www.partselect.com/Repair/{appliance_type}/{formatted_symptom}/"
-    print(f"Fetching general repair info from: {general_repair_url}")
-    return scrape_general_repair_info(general_repair_url)
+    general_repair_url = f"{PARTSELECT_BASE_URL}/Repair/{appliance_type}/{formatted_symptom}/"
+    logger.debug("Fetching general repair info from: %s", general_repair_url)
+    return await scrape_cache.get_or_fetch("repair", normalize_url(general_repair_url), lambda: scrape_general_repair_info(general_repair_url))
 
-def scrape_general_repair_info(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        main_content = soup.find('div', id='main')
-        if not main_content:
-            return {"error": "Main content not found on the page"}
-
-        video_url = None
-        video_container = main_content.find('div', class_='yt-video')
-        if video_container and 'data-yt-init' in video_container.attrs:
-            video_url = f"https://www.youtube.com/watch?v={video_container['data-yt-init']}"
-
-        repair_stats = main_content.find('div', class_='repair__intro')
-        repair_info = {}
-        if repair_stats:
-            difficulty = repair_stats.find('li', string=lambda text: 'Rated as' in text if text else False)
-            repair_stories = repair_stats.find('li', string=lambda text: 'repair stories' in text if text else False)
-            step_videos = repair_stats.find('li', string=lambda text: 'step by step videos' in text if text else False)
-            
-            repair_info = {
-                "difficulty": difficulty.text.strip() if difficulty else "Not specified",
-                "repair_stories": repair_stories.text.strip() if repair_stories else "Not specified",
-                "step_videos": step_videos.text.strip() if step_videos else "Not specified"
-            }
+def parse_repair_page(html, url):
+    soup = make_soup(html, REPAIR_PAGE_STRAINER)
 
-        causes = []
-        symptom_list = main_content.find('div', class_='symptom-list')
-        if symptom_list:
-            cause_sections = symptom_list.find_all('div', class_='symptom-list__desc')
-            for section in cause_sections:
-                cause_title = section.find_previous('h2', class_='section-title')
-                cause_description = section.find('div', class_='col-lg-6')
-                if cause_title and cause_description:
-                    causes.append({
-                        "title": cause_title.text.strip(),
-                        "description": cause_description.text.strip()
-                    })
+    main_content = soup.find('div', id='main')
+    if not main_content:
+        return {"error": "Main content not found on the page"}
 
-        return {
-            'video_url': video_url,
-            'repair_info': repair_info,
-            'causes': causes,
-            'link_to_repair_webpage': url
+    video_url = None
+    video_container = main_content.find('div', class_='yt-video')
+    if video_container and 'data-yt-init' in video_container.attrs:
+        video_url = f"https://www.youtube.com/watch?v={video_container['data-yt-init']}"
+
+    repair_stats = main_content.find('div', class_='repair__intro')
+    repair_info = {}
+    if repair_stats:
+        difficulty = repair_stats.find('li', string=lambda text: 'Rated as' in text if text else False)
+        repair_stories = repair_stats.find('li', string=lambda text: 'repair stories' in text if text else False)
+        step_videos = repair_stats.find('li', string=lambda text: 'step by step videos' in text if text else False)
+        
+        repair_info = {
+            "difficulty": difficulty.text.strip() if difficulty else "Not specified",
+            "repair_stories": repair_stories.text.strip() if repair_stories else "Not specified",
+            "step_videos": step_videos.text.strip() if step_videos else "Not specified"
         }
-    except requests.RequestException as e:
-        print(f"RequestException in scrape_general_repair_info: {str(e)}")
+
+    causes = []
+    symptom_list = main_content.find('div', class_='symptom-list')
+    if symptom_list:
+        cause_sections = symptom_list.find_all('div', class_='symptom-list__desc')
+        for section in cause_sections:
+            cause_title = section.find_previous('h2', class_='section-title')
+            cause_description = section.find('div', class_='col-lg-6')
+            if cause_title and cause_description:
+                causes.append({
+                    "title": cause_title.text.strip(),
+                    "description": cause_description.text.strip()
+                })
+
+    return {
+        'video_url': video_url,
+        'repair_info': repair_info,
+        'causes': causes,
+        'link_to_repair_webpage': url
+    }
+
+async def scrape_general_repair_info(url):
+    try:
+        response = await fetch(url)
+        return await asyncio.to_thread(parse_repair_page, response.text, url)
+    except httpx.HTTPError as e:
+        logger.error("Request failed in scrape_general_repair_info: %s", e)
         return {"error": f"Failed to fetch the page: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error in scrape_general_repair_info: {str(e)}")
+        logger.exception("Unexpected error in scrape_general_repair_info: %s", e)
         return {"error": f"An unexpected error occurred: {str(e)}"}
     
-def search_a_models_parts_by_name(model_number: str, part_name: str):
-    print(f"Searching for part '{part_name}' in model {model_number}")
-    base_url = "https://www.partselect.com"
-    parts_url = f"{base_url}/Models/{model_number}/Parts/"
+async def search_a_models_parts_by_name(model_number: str, part_name: str, limit: int = MAX_PART_SEARCH_RESULTS):
+    if part_search_index.enabled and await asyncio.to_thread(part_search_index.is_indexed, model_number):
+        search_results = await asyncio.to_thread(part_search_index.search, model_number, part_name, limit)
+        # No local hits may just mean the site matches the words differently, so it gets the final say
+        if search_results:
+            PART_SEARCHES.labels("local").inc()
+            return await add_current_prices(search_results)
+    PART_SEARCHES.labels("live").inc()
+    cache_key = f"{model_number.strip().upper()}|{part_name.strip().lower()}|{limit}"
+    return await scrape_cache.get_or_fetch("part_search", cache_key, lambda: scrape_part_search(model_number, part_name, limit))
+
+async def add_current_prices(search_results):
+    """Fill in price, availability and image for locally found parts whose page is fresh in the part cache."""
+    if not SCRAPE_CACHE_ENABLED:
+        return search_results
+    ttl, _ = SCRAPE_CACHE_TTLS["part"]
+    for part_info in search_results:
+        # Search cards link the part as "url", catalog part records as "part_url"
+        _, part_page, age = await scrape_cache.lookup("part", normalize_url(part_info.get("url") or part_info["part_url"]))
+        if part_page is not None and age < ttl:
+            for field in ("price", "availability", "image_url"):
+                if part_page.get(field):
+                    part_info[field] = part_page[field]
+    return search_results
+
+async def scrape_part_search(model_number: str, part_name: str, limit: int):
+    logger.debug("Searching for part '%s' in model %s", part_name, model_number)
+    parts_url = f"{PARTSELECT_BASE_URL}/Models/{model_number}/Parts/"
     search_results = []
 
     try:
-        session = requests.Session()
-        
         search_url = f"{parts_url}?SearchTerm={quote(part_name)}"
-        print(f"Searching at URL: {search_url}")
+        logger.debug("Searching at URL: %s", search_url)
         
-        while search_url:
-            response = session.get(search_url)
-            response.raise_for_status()
-            
-            print(f"Response status code: {response.status_code}")
-            print(f"Response URL: {response.url}")
+        async with aclosing(iter_listing_pages(search_url)) as pages:
+            async for page_url, soup in pages:
+                no_results = soup.find('div', class_='alert alert-info')
+                if no_results and "We couldn't find any parts" in no_results.text:
+                    logger.debug("No results found for '%s'", part_name)
+                    return []
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+                for card in parse_parts_page(soup, page_url, details=True):
+                    search_results.append(card)
+                    logger.debug("Found part: %s", card.name)
             
-            no_results = soup.find('div', class_='alert alert-info')
-            if no_results and "We couldn't find any parts" in no_results.text:
-                print(f"No results found for '{part_name}'")
-                return []
-            
-            part_items = soup.find_all('div', class_='mega-m__part')
-            print(f"Number of part items found on this page: {len(part_items)}")
-            
-            for item in part_items:
-                part_info = {}
-                
-                part_link = item.find('a', class_='bold mb-1 mega-m__part__name')
-                if part_link:
-                    part_info['name'] = part_link.text.strip()
-                    part_info['url'] = urljoin(base_url, part_link.get('href', ''))
-                    print(f"Found part: {part_info['name']}")
-                
-                ps_match = re.search(r'PartSelect #:\s*(PS\d+)', item.text)
-                if ps_match:
-                    part_info['ps_number'] = ps_match.group(1)
-                    print(f"PartSelect number: {part_info['ps_number']}")
-                
-                mfg_match = re.search(r'Manufacturer #:\s*(\S+)', item.text)
-                if mfg_match:
-                    part_info['mfg_number'] = mfg_match.group(1)
-                    print(f"Manufacturer number: {part_info['mfg_number']}")
-                
-                price_element = item.find('div', class_='mega-m__part__price')
-                if price_element:
-                    part_info['price'] = price_element.text.strip()
-                    print(f"Price: {part_info['price']}")
-                
-                availability_element = item.find('div', class_='mega-m__part__avlbl')
-                if availability_element:
-                    part_info['availability'] = availability_element.text.strip()
-                    print(f"Availability: {part_info['availability']}")
-                
-                # Updated image URL extraction
-                image_container = item.find('a', class_='mega-m__part__img')
-                if image_container:
-                    picture_element = image_container.find('picture')
-                    if picture_element:
-                        webp_source = picture_element.find('source', type='image/webp')
-                        if webp_source and 'data-srcset' in webp_source.attrs:
-                            # Get the first URL from data-srcset (ignoring the 2x version)
-                            part_info['image_url'] = webp_source['data-srcset'].split(',')[0].strip().split()[0]
-                        else:
-                            jpeg_source = picture_element.find('source', type='image/jpeg')
-                            if jpeg_source and 'data-srcset' in jpeg_source.attrs:
-                                # If webp is not available, use jpeg
-                                part_info['image_url'] = jpeg_source['data-srcset'].split(',')[0].strip().split()[0]
-                            else:
-                                img_element = picture_element.find('img')
-                                if img_element and 'data-src' in img_element.attrs:
-                                    part_info['image_url'] = img_element['data-src']
-                                else:
-                                    part_info['image_url'] = "Image not available"
-                    else:
-                        part_info['image_url'] = "Image not available"
-                else:
-                    part_info['image_url'] = "Image not available"
-                print(f"Image URL: {part_info['image_url']}")
-                
-                if part_info:
-                    search_results.append(part_info)
-                    print(f"Added part to results: {part_info}")
-            
-            next_page = soup.find('li', class_='next')
-            if next_page and next_page.find('a'):
-                next_link = next_page.find('a')
-                if next_link and 'href' in next_link.attrs:
-                    search_url = urljoin(parts_url, next_link['href'])
-                    print(f"Moving to next page: {search_url}")
-                else:
-                    search_url = None
-                    print("No more pages (next link without href)")
-            else:
-                search_url = None
-                print("No more pages")
+                # Stop paginating once there are enough hits for the LLM
+                if len(search_results) >= limit:
+                    logger.debug("Reached the limit of %s results", limit)
+                    search_results = search_results[:limit]
+                    break
         
-        print(f"Total parts found: {len(search_results)}")
-        return search_results
+        logger.debug("Total parts found: %s", len(search_results))
+        await compatibility_index.record(normalize_part_number(model_number), search_results, complete=False)
+        return [card.to_dict(PART_SEARCH_FIELDS) for card in search_results]
 
-    except requests.RequestException as e:
-        print(f"RequestException in search_a_models_parts_by_name: {str(e)}")
+    except httpx.HTTPError as e:
+        logger.error("Request failed in search_a_models_parts_by_name: %s", e)
         return {"error": f"Failed to search for parts: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error in search_a_models_parts_by_name: {str(e)}")
+        logger.exception("Unexpected error in search_a_models_parts_by_name: %s", e)
         return {"error": f"An unexpected error occurred: {str(e)}"}
     
-@app.post("/query")
-async def process_query(query: Query):
-    try:
-        print(f"Received query: {query.query}")
+async def call_tool(tool_call):
+    if tool_call.function.name == "get_part_or_model_info":
+        function_args = json.loads(tool_call.function.arguments)
+        query_items = function_args.get("query_items", [])
+        logger.debug("AI detected query items: %s", query_items)
+        return await get_part_or_model_info(*query_items)
 
-        if conversation.is_conversation_limit_reached():
-            return {"response": "This conversation is getting too long. Let's start a new one!", "conversation_ended": True}
-        
-        conversation.add_message("user", query.query)
+    elif tool_call.function.name == "check_compatibility":
+        function_args = json.loads(tool_call.function.arguments)
+        model_number = function_args.get("model_number")
+        part_number = function_args.get("part_number")
+        return await check_compatibility(model_number, part_number)
+
+    elif tool_call.function.name == "get_repair_info":
+        logger.debug("Calling get_repair_info function")
+        function_args = json.loads(tool_call.function.arguments)
+        logger.debug("Function arguments: %s", function_args)
+        repair_info = await get_repair_info(
+            function_args["appliance_type"],
+            function_args["symptom"]
+        )
+        log_payload("Repair info result", repair_info)
+        return repair_info
+
+    elif tool_call.function.name == "search_a_models_parts_by_name":
+        function_args = json.loads(tool_call.function.arguments)
+        model_number = function_args.get("model_number")
+        part_name = function_args.get("part_name")
+        max_results = max(1, min(int(function_args.get("max_results") or MAX_PART_SEARCH_RESULTS), MAX_PART_SEARCH_RESULTS))
+        logger.debug("Calling search_a_models_parts_by_name with model_number: %s, part_name: %s", model_number, part_name)
+        search_results = await search_a_models_parts_by_name(model_number, part_name, max_results)
         
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_part_or_model_info",
-                    "description": "Get detailed information about specific parts or models by their numbers (includes installation instructions if called with a model number)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query_items": {
-                                "type": "array",
-                                "items": {
-                                    "type": "string"
-                                },
-                                "description": "The part numbers, model numbers, or names to look up (maximum 4)"
-                            }
+        if isinstance(search_results, dict) and "error" in search_results:
+            logger.error("Error in search_a_models_parts_by_name: %s", search_results['error'])
+            return {"error": search_results['error']}
+        else:
+            log_payload("Search results", search_results)
+            return search_results
+
+    return None
+
+async def run_tool_call(tool_call):
+    tool_name = tool_call.function.name
+    start = time.perf_counter()
+    try:
+        with span("tool", tool=tool_name):
+            result = await asyncio.wait_for(call_tool(tool_call), timeout=TOOL_CALL_TIMEOUT)
+        if isinstance(result, dict) and ("error" in result or result.get("type") == "error"):
+            TOOL_ERRORS.labels(tool_name, "error_result").inc()
+        return result
+    except asyncio.TimeoutError:
+        TOOL_ERRORS.labels(tool_name, "timeout").inc()
+        logger.warning("Tool call %s timed out after %s seconds", tool_name, TOOL_CALL_TIMEOUT)
+        return {"error": f"{tool_name} timed out after {TOOL_CALL_TIMEOUT} seconds"}
+    except Exception as e:
+        TOOL_ERRORS.labels(tool_name, "exception").inc()
+        logger.error("Error running tool call %s: %s", tool_name, e)
+        return {"error": f"An unexpected error occurred: {str(e)}"}
+    finally:
+        TOOL_DURATION.labels(tool_name).observe(time.perf_counter() - start)
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_part_or_model_info",
+            "description": "Get detailed information about specific parts or models by their numbers (includes installation instructions if called with a model number)",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query_items": {
+                        "type": "array",
+                        "items": {
+                            "type": "string"
                         },
-                        "required": ["query_items"]
+                        "description": f"The part numbers, model numbers, or names to look up (maximum {MAX_PARTS_PER_QUERY})"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "check_compatibility",
-                    "description": "Check if a part is compatible with a specific model",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "model_number": {
-                                "type": "string",
-                                "description": "The model number to check compatibility for"
-                            },
-                            "part_number": {
-                                "type": "string",
-                                "description": "The part number to check compatibility for"
-                            }
-                        },
-                        "required": ["model_number", "part_number"]
+                },
+                "required": ["query_items"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_compatibility",
+            "description": "Check if a part is compatible with a specific model",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "model_number": {
+                        "type": "string",
+                        "description": "The model number to check compatibility for"
+                    },
+                    "part_number": {
+                        "type": "string",
+                        "description": "The part number to check compatibility for"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_repair_info",
-                    "description": "Get repair information for appliance issues. Note: Always display the videos returned by this using the special sintaxe.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "appliance_type": {
-                                "type": "string",
-                                "enum": ["Dishwasher", "Refrigerator"],
-                                "description": "The type of appliance"
-                            },
-                            "symptom": {
-                                "type": "string",
-                                "description": "The problem or symptom the appliance is experiencing"
-                            }
-                        },
-                        "required": ["appliance_type", "symptom"]
+                },
+                "required": ["model_number", "part_number"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_repair_info",
+            "description": "Get repair information for appliance issues. Note: Always display the videos returned by this using the special sintaxe.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "appliance_type": {
+                        "type": "string",
+                        "enum": ["Dishwasher", "Refrigerator"],
+                        "description": "The type of appliance"
+                    },
+                    "symptom": {
+                        "type": "string",
+                        "description": "The problem or symptom the appliance is experiencing"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_a_models_parts_by_name",
-                    "description": "Search for parts to buy by name on a specific model's parts page",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "model_number": {
-                                "type": "string",
-                                "description": "The model number of the appliance"
-                            },
-                            "part_name": {
-                                "type": "string",
-                                "description": "The name or type of the part to search for"
-                            }
-                        },
-                        "required": ["model_number", "part_name"]
+                },
+                "required": ["appliance_type", "symptom"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_a_models_parts_by_name",
+            "description": "Search for parts to buy by name on a specific model's parts page",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "model_number": {
+                        "type": "string",
+                        "description": "The model number of the appliance"
+                    },
+                    "part_name": {
+                        "type": "string",
+                        "description": "The name or type of the part to search for"
+                    },
+                    "max_results": {
+                        "type": "integer",
+                        "description": f"How many matching parts to return (maximum {MAX_PART_SEARCH_RESULTS})"
                     }
-                }
+                },
+                "required": ["model_number", "part_name"]
             }
+        }
+    }
+]
+
+TOOL_PROGRESS_LABELS = {
+    "get_part_or_model_info": "Looking up parts and models on partselect.com",
+    "check_compatibility": "Checking compatibility",
+    "get_repair_info": "Finding repair guides",
+    "search_a_models_parts_by_name": "Searching the model's parts"
+}
+
+def parse_tool_arguments(tool_call):
+    try:
+        return json.loads(tool_call.function.arguments)
+    except (TypeError, ValueError):
+        return {}
+
+RELEVANCE_TERM_PATTERN = re.compile(r"[a-z0-9]+")
+RELEVANCE_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "the", "this", "to", "what", "with", "you", "your", "part", "parts", "model"
+}
+
+def stem(word):
+    # Crude suffix stripping so "replacing"/"replace" and "wheels"/"wheel" meet
+    for suffix in ("ing", "ed", "es", "s", "e"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def relevance_terms(text):
+    return {stem(term) for term in RELEVANCE_TERM_PATTERN.findall(text.lower()) if term not in RELEVANCE_STOPWORDS}
+
+def rank_by_relevance(items, query, text_of):
+    """
+    Order items by how well their text matches the query: each query term found in an item
+    scores its IDF across the items, counting prefix matches ("dish"/"dishwasher").
+    The sort is stable, so unmatched items keep the site's order.
+    """
+    query_terms = relevance_terms(query)
+    item_terms = [relevance_terms(text_of(item)) for item in items]
+
+    def matches(term, terms):
+        return any(word == term or (min(len(word), len(term)) >= 4 and (word.startswith(term) or term.startswith(word))) for word in terms)
+
+    idf = {}
+    for term in query_terms:
+        document_frequency = sum(1 for terms in item_terms if matches(term, terms))
+        idf[term] = math.log(1 + len(items) / (1 + document_frequency))
+    scores = [sum(idf[term] for term in query_terms if matches(term, terms)) for terms in item_terms]
+    return [item for _, item in sorted(zip(scores, items), key=lambda pair: -pair[0])]
+
+def display_title(display):
+    # {{display:video|URL|TITLE}} -> TITLE
+    return display.strip("{}").split("|")[-1]
+
+def keep_most_relevant(container, key, query, limit, text_of):
+    items = container.get(key)
+    if not isinstance(items, list) or len(items) <= limit:
+        return
+    container[key] = rank_by_relevance(items, query, text_of)[:limit]
+    container[f"{key}_total"] = len(items)
+    container[f"more_{key}_available"] = f"Showing the {limit} {key} most relevant to the question out of {len(items)}; ask again naming what you need to see others."
+
+def shape_tool_payload(tool_call, payload, user_query):
+    """Cut a tool result down to what is relevant to the user's message before it goes into the prompt."""
+    if tool_call.function.name == "get_part_or_model_info" and isinstance(payload, dict):
+        shaped = {}
+        for item, info in payload.items():
+            if isinstance(info, dict) and info.get("type") == "model":
+                info = dict(info)
+                for key in ("manuals", "diagrams", "videos"):
+                    keep_most_relevant(info, key, user_query, PAYLOAD_MAX_MEDIA, display_title)
+            shaped[item] = info
+        return shaped
+
+    if tool_call.function.name == "search_a_models_parts_by_name" and isinstance(payload, list):
+        query = f"{parse_tool_arguments(tool_call).get('part_name', '')} {user_query}"
+        shaped = {"parts": payload}
+        keep_most_relevant(shaped, "parts", query, PAYLOAD_MAX_PARTS, lambda part: part.get("name", ""))
+        return shaped if len(shaped) > 1 else payload
+
+    return payload
+
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "1") == "1"
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 500))
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", 15 * 60))
+
+class CompletionCache:
+    """
+    Assistant messages keyed by a hash of the exact prompt (normalized messages, tools schema
+    and model), so a repeated turn skips the OpenAI round trip. Bounded LRU with a TTL.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, messages, tools):
+        normalized = [
+            {"role": message["role"], "name": message.get("name"), "content": " ".join((message.get("content") or "").split())}
+            for message in messages
         ]
+        payload = json.dumps({"model": model, "messages": normalized, "tools": tools}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode()).hexdigest()
 
-        print("Calling OpenAI API for response")
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=conversation.get_messages(),
-            tools=tools,
-            tool_choice="auto"
-        )
+    def get(self, key):
+        if not COMPLETION_CACHE_ENABLED:
+            return None
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, message):
+        if not COMPLETION_CACHE_ENABLED or not (message.content or message.tool_calls):
+            return
+        self.entries[key] = (time.monotonic(), message)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+completion_cache = CompletionCache(COMPLETION_CACHE_MAX_ENTRIES, COMPLETION_CACHE_TTL)
+
+def report_prompt_size(conversation, usage):
+    # Estimated vs. billed prompt size, for tuning CONTEXT_TOKEN_BUDGET
+    if usage:
+        OPENAI_TOKENS.labels("prompt").inc(usage.prompt_tokens)
+        OPENAI_TOKENS.labels("completion").inc(usage.completion_tokens)
+    billed = f", {usage.prompt_tokens} billed" if usage else ""
+    logger.info("Prompt size: ~%s tokens estimated%s (budget %s)", conversation.prompt_tokens, billed, CONTEXT_TOKEN_BUDGET)
+
+async def run_query_turn(user_query: str, session_id: Optional[str] = None, stream: bool = False):
+    """
+    Run one turn on a session's conversation, holding the session's lock for the whole turn.
+    Sessions are created on first use; the done event carries the ID so the client can continue it.
+    """
+    session_id = session_id or LEGACY_SESSION_ID
+    with traced_request("query") as trace:
+        prefetched = start_speculative_lookups(user_query)
+        try:
+            async with session_store.session(session_id) as conversation:
+                async with aclosing(run_conversation_turn(conversation, user_query, stream)) as events:
+                    async for event, data in events:
+                        if event == "done":
+                            data = {**data, "session_id": session_id, "request_id": trace.request_id}
+                        yield event, data
+        finally:
+            drop_speculative_lookups(prefetched)
+
+async def run_conversation_turn(conversation, user_query: str, stream: bool = False):
+    """
+    Run one conversation turn and yield (event, data) pairs as it progresses:
+    tool_start / tool_finish around each scraper, token for each streamed piece of the final
+    answer (only when stream is True), and finally done with the complete response.
+    """
+    try:
+        logger.info("Received query: %s", user_query)
+
+        if conversation.is_conversation_limit_reached():
+            yield "done", {"response": "This conversation is getting too long. Let's start a new one!", "conversation_ended": True}
+            return
         
-        assistant_message = response.choices[0].message
-        print(f"Assistant message: {assistant_message}")
+        await conversation.add_message("user", user_query)
+
+        logger.debug("Calling OpenAI API for response")
+        messages = conversation.get_messages()
+        cache_key = completion_cache.key(CHAT_MODEL, messages, TOOLS)
+        assistant_message = completion_cache.get(cache_key)
+        if assistant_message is None:
+            with OPENAI_DURATION.labels("tool_selection").time(), span("openai", call="tool_selection"):
+                response = await client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    tools=TOOLS,
+                    tool_choice="auto"
+                )
+            report_prompt_size(conversation, response.usage)
+            assistant_message = response.choices[0].message
+            completion_cache.put(cache_key, assistant_message)
+        else:
+            logger.info("Answered tool selection from the completion cache")
+        
+        log_payload("Assistant message", assistant_message)
 
         if assistant_message.tool_calls:
-            for tool_call in assistant_message.tool_calls:
-                if tool_call.function.name == "get_part_or_model_info":
-                    function_args = json.loads(tool_call.function.arguments)
-                    query_items = function_args.get("query_items", [])
-                    print(f"AI detected query items: {query_items}")
-                    item_info = get_part_or_model_info(*query_items)
-                    
-                    conversation.add_message("function", json.dumps(item_info), name="get_part_or_model_info")
-
-                elif tool_call.function.name == "check_compatibility":
-                    function_args = json.loads(tool_call.function.arguments)
-                    model_number = function_args.get("model_number")
-                    part_number = function_args.get("part_number")
-                    compatibility_info = check_compatibility(model_number, part_number)
-                    
-                    conversation.add_message("function", json.dumps(compatibility_info), name="check_compatibility")
-
-                elif tool_call.function.name == "get_repair_info":
-                    print("Calling get_repair_info function")
-                    function_args = json.loads(tool_call.function.arguments)
-                    print(f"Function arguments: {function_args}")
-                    repair_info = get_repair_info(
-                        function_args["appliance_type"],
-                        function_args["symptom"]
-                    )
-                    print(f"Repair info result: {repair_info}")
-                    conversation.add_message("function", json.dumps(repair_info), name="get_repair_info")
-
-                elif tool_call.function.name == "search_a_models_parts_by_name":
-                    function_args = json.loads(tool_call.function.arguments)
-                    model_number = function_args.get("model_number")
-                    part_name = function_args.get("part_name")
-                    print(f"Calling search_a_models_parts_by_name with model_number: {model_number}, part_name: {part_name}")
-                    search_results = search_a_models_parts_by_name(model_number, part_name)
-                    
-                    if isinstance(search_results, dict) and "error" in search_results:
-                        print(f"Error in search_a_models_parts_by_name: {search_results['error']}")
-                        conversation.add_message("function", json.dumps({"error": search_results['error']}), name="search_a_models_parts_by_name")
-                    else:
-                        print(f"Search results: {json.dumps(search_results, indent=2)}")
-                        conversation.add_message("function", json.dumps(search_results), name="search_a_models_parts_by_name")
+            tool_events = asyncio.Queue()
+
+            async def run_tool_call_with_events(tool_call):
+                await tool_events.put(("tool_start", {
+                    "id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "label": TOOL_PROGRESS_LABELS.get(tool_call.function.name, "Searching for information on partselect.com"),
+                    "arguments": parse_tool_arguments(tool_call)
+                }))
+                start = time.perf_counter()
+                tool_result = await run_tool_call(tool_call)
+                await tool_events.put(("tool_finish", {
+                    "id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "ok": not (isinstance(tool_result, dict) and "error" in tool_result),
+                    "duration_ms": round((time.perf_counter() - start) * 1000)
+                }))
+                return tool_result
+
+            # Independent tool calls run concurrently; results are appended in the order the model asked for them
+            tool_tasks = [asyncio.ensure_future(run_tool_call_with_events(tool_call)) for tool_call in assistant_message.tool_calls]
+            try:
+                for _ in range(2 * len(tool_tasks)):
+                    yield await tool_events.get()
+                tool_results = await asyncio.gather(*tool_tasks)
+            finally:
+                for task in tool_tasks:
+                    task.cancel()
+
+            for tool_call, tool_result in zip(assistant_message.tool_calls, tool_results):
+                if tool_result is not None:
+                    tool_result = shape_tool_payload(tool_call, tool_result, user_query)
+                    await conversation.add_message("function", json.dumps(tool_result), name=tool_call.function.name)
             
-            print("Getting final response after function calls")
-            final_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=conversation.get_messages(),
-                tools=tools,
-                tool_choice="auto"
-            )
-            assistant_response = final_response.choices[0].message.content
+            logger.debug("Getting final response after function calls")
+            messages = conversation.get_messages()
+            cache_key = completion_cache.key(CHAT_MODEL, messages, TOOLS)
+            cached_message = completion_cache.get(cache_key)
+            if cached_message is not None:
+                logger.info("Answered from the completion cache")
+                assistant_response = cached_message.content
+                if stream and assistant_response:
+                    yield "token", {"content": assistant_response}
+            elif stream:
+                with span("openai", call="final_answer", stream=True):
+                    start = time.perf_counter()
+                    final_stream = await client.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=messages,
+                        tools=TOOLS,
+                        tool_choice="auto",
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                    response_parts = []
+                    usage = None
+                    async for chunk in final_stream:
+                        usage = chunk.usage or usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            response_parts.append(chunk.choices[0].delta.content)
+                            yield "token", {"content": chunk.choices[0].delta.content}
+                    OPENAI_DURATION.labels("final_answer").observe(time.perf_counter() - start)
+                report_prompt_size(conversation, usage)
+                assistant_response = "".join(response_parts) or None
+                completion_cache.put(cache_key, ChatCompletionMessage(role="assistant", content=assistant_response))
+            else:
+                with OPENAI_DURATION.labels("final_answer").time(), span("openai", call="final_answer"):
+                    final_response = await client.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=messages,
+                        tools=TOOLS,
+                        tool_choice="auto"
+                    )
+                report_prompt_size(conversation, final_response.usage)
+                assistant_response = final_response.choices[0].message.content
+                completion_cache.put(cache_key, final_response.choices[0].message)
         else:
             assistant_response = assistant_message.content
+            if stream and assistant_response:
+                yield "token", {"content": assistant_response}
         
         if assistant_response is None:
             assistant_response = "I apologize, but I couldn't generate a proper response. Could you please rephrase your question?"
 
-        conversation.add_message("assistant", assistant_response)
+        await conversation.add_message("assistant", assistant_response)
         
-        print("Final response generated")
-        print(f"Assistant response: {assistant_response}")
+        logger.info("Final response generated")
+        log_payload("Assistant response", assistant_response)
         
-        return {
+        yield "done", {
             "response": assistant_response,
             "conversation_ended": False
         }
 
     except Exception as e:
-        print(f"An error occurred while processing the query: {str(e)}")
+        logger.exception("An error occurred while processing the query: %s", e)
         error_message = f"I apologize, but I encountered an error while processing your request. Please try again or rephrase your question. Error details: {str(e)}"
-        conversation.add_message("assistant", error_message)
-        return {"response": error_message, "conversation_ended": False}
+        await conversation.add_message("assistant", error_message)
+        yield "done", {"response": error_message, "conversation_ended": False}
+
+@app.post("/query")
+async def process_query(query: Query):
+    result = None
+    with QUERY_DURATION.labels("/query").time():
+        async with aclosing(run_query_turn(query.query, query.session_id)) as events:
+            async for event, data in events:
+                if event == "done":
+                    result = data
+    return result
+
+@app.post("/query/stream")
+async def process_query_stream(query: Query):
+    async def event_stream():
+        with QUERY_DURATION.labels("/query/stream").time():
+            async with aclosing(run_query_turn(query.query, query.session_id, stream=True)) as events:
+                async for event, data in events:
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
     
 @app.post("/reset")
-async def reset_conversation():
-    global conversation
-    conversation.reset()
+async def reset_conversation(request: Optional[SessionRequest] = None):
+    session_id = request.session_id if request and request.session_id else LEGACY_SESSION_ID
+    async with session_store.session(session_id) as conversation:
+        await asyncio.to_thread(conversation.reset)
     return {"message": "Conversation reset successfully"}
 
+@app.get("/compatibility/{part_number}/models")
+async def compatible_models(part_number: str):
+    return {
+        "part_number": part_number,
+        "models": compatibility_index.models_for_part(part_number)
+    }
+
+@app.post("/compatibility/bulk")
+async def bulk_compatibility(request: BulkCompatibilityRequest, authorization: Optional[str] = Header(default=None)):
+    """
+    Stream one NDJSON line per distinct pair as its model finishes. Every line names its pair,
+    so an interrupted client resumes by resending the pairs it has no line for.
+    """
+    if not BULK_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(authorization or "", f"Bearer {BULK_API_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid or missing bulk API token")
+    if len(request.pairs) > BULK_MAX_PAIRS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_PAIRS} pairs per request")
+
+    async def results():
+        pairs = [(pair.model_number, pair.part_number) for pair in request.pairs]
+        async with aclosing(check_compatibility_bulk(pairs)) as checked:
+            async for result in checked:
+                yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def metrics():
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/debug/traces")
+async def debug_traces(min_duration_ms: float = 0, limit: int = 20):
+    """Recent sampled /query traces, slowest first."""
+    if not DEBUG_TRACES_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    traces = [trace for trace in list(recent_traces) if trace.duration * 1000 >= min_duration_ms]
+    traces.sort(key=lambda trace: trace.duration, reverse=True)
+    return {"traces": [trace.to_dict() for trace in traces[:limit]]}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"scrape_cache": scrape_cache.stats(), "completion_cache": completion_cache.stats()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""
+Shared start-up for the command-line tools (bench.py, bulk_check.py, crawl_catalog.py), which
+use app.py's scrapers and stores without the web server.
+
+    app = app_runner.import_app({"SCRAPE_CACHE_ENABLED": "0"})
+    async with app_runner.running(app):
+        ...
+"""
+import os
+import sys
+from contextlib import asynccontextmanager
+
+def import_app(env=None, defaults=None):
+    """
+    Import app.py after setting env, and defaults for whatever isn't already set; app.py
+    reads its configuration from the environment when it is first imported.
+    """
+    os.environ.update(env or {})
+    defaults = {
+        "OPENAI_API_KEY": "unused",
+        "REPAIR_SNAPSHOT_ENABLED": "0",  # the tools never answer repair questions
+        **(defaults or {}),
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    return app
+
+@asynccontextmanager
+async def running(app):
+    """Run the app's lifespan around the block, so everything it opens is closed as on server shutdown."""
+    async with app.lifespan(app.app):
+        yield app
@@ -0,0 +1,238 @@
+"""
+Offline benchmark for the partselect.com scrapers in app.py.
+
+Serves the saved pages in fixtures/partselect from a local stand-in HTTP server, points
+app.py at it and times each scraper against them, reporting wall time, HTML parse time,
+allocations and pages fetched per second.
+
+    python bench.py                       # 20 rounds with the default parser
+    python bench.py --rounds 50 --parser html.parser
+    python bench.py --check               # check every parser extracts identical results
+    python bench.py --capture             # refresh the fixtures from the live site
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app_runner
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "partselect")
+LIVE_BASE_URL = "https://www.partselect.com"
+MODEL_NUMBER = "WDT780SAEM1"
+
+def load_routes():
+    with open(os.path.join(FIXTURES_DIR, "routes.json")) as f:
+        return json.load(f)
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    routes = {}
+
+    def do_GET(self):
+        route = self.routes.get(self.path)
+        if route is None:
+            self.send_error(404)
+            return
+        if isinstance(route, dict):
+            self.send_response(302)
+            self.send_header("Location", route["redirect"])
+            self.end_headers()
+            return
+        with open(os.path.join(FIXTURES_DIR, route), "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fixture_server():
+    FixtureHandler.routes = load_routes()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def import_app(base_url, parser=None):
+    # Scrape against the stand-in server, with nothing cached or indexed between rounds
+    env = {
+        "PARTSELECT_BASE_URL": base_url,
+        "SCRAPE_CACHE_ENABLED": "0",
+        "COMPAT_INDEX_ENABLED": "0",
+        "PART_SEARCH_INDEX_ENABLED": "0",
+        "SCRAPE_CACHE_DB": ":memory:",
+        "COMPAT_INDEX_DB": ":memory:",
+        "CONVERSATIONS_DB": ":memory:",
+        "HTTP_RATE_LIMIT": "0",
+    }
+    if parser:
+        env["HTML_PARSER"] = parser
+    # LOG_LEVEL keeps the scrapers' per-part debug logging out of the report
+    return app_runner.import_app(env, defaults={"LOG_LEVEL": "WARNING", "OPENAI_API_KEY": "bench"})
+
+def scenarios(app, base_url):
+    part_path = next(path for path, route in load_routes().items() if route == "part_page.html")
+    return {
+        "search_part": lambda: app.search_part(f"{base_url}{part_path}"),
+        "search_model": lambda: app.search_model(f"{base_url}/Models/{MODEL_NUMBER}/"),
+        "get_all_parts": lambda: app.get_all_parts(f"{base_url}/Models/{MODEL_NUMBER}/"),
+        "scrape_general_repair_info": lambda: app.scrape_general_repair_info(f"{base_url}/Repair/Dishwasher/Not-Draining/"),
+        "search_a_models_parts_by_name": lambda: app.search_a_models_parts_by_name(MODEL_NUMBER, "wheel"),
+        "search_a_models_parts_by_name (no results)": lambda: app.search_a_models_parts_by_name(MODEL_NUMBER, "transmogrifier"),
+    }
+
+class Instruments:
+    """Wraps app.fetch and app.make_soup to count pages and time HTML parsing."""
+    def __init__(self, app):
+        self.pages = 0
+        self.parse_seconds = 0.0
+        fetch, make_soup = app.fetch, app.make_soup
+
+        async def counting_fetch(url, *args, **kwargs):
+            response = await fetch(url, *args, **kwargs)
+            self.pages += 1
+            return response
+
+        def timed_make_soup(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return make_soup(*args, **kwargs)
+            finally:
+                self.parse_seconds += time.perf_counter() - start
+
+        app.fetch = counting_fetch
+        app.make_soup = timed_make_soup
+
+    def reset(self):
+        self.pages = 0
+        self.parse_seconds = 0.0
+
+async def run_benchmark(app, base_url, rounds):
+    instruments = Instruments(app)
+    rows = []
+    for name, factory in scenarios(app, base_url).items():
+        await factory()  # warm up connections and imports
+
+        durations = []
+        instruments.reset()
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await factory()
+            durations.append(time.perf_counter() - start)
+        total_seconds = sum(durations)
+        pages, parse_seconds = instruments.pages, instruments.parse_seconds
+
+        tracemalloc.start()
+        await factory()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        allocated_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        tracemalloc.stop()
+
+        rows.append({
+            "scenario": name,
+            "mean_ms": statistics.mean(durations) * 1000,
+            "p95_ms": sorted(durations)[max(0, int(len(durations) * 0.95) - 1)] * 1000,
+            "parse_ms": parse_seconds / rounds * 1000,
+            "pages_per_call": pages / rounds,
+            "pages_per_sec": pages / total_seconds if total_seconds else 0.0,
+            "peak_kib": peak_bytes / 1024,
+            "live_blocks": allocated_blocks,
+        })
+    return rows
+
+def print_report(rows, parser, rounds):
+    print(f"parser={parser} rounds={rounds}")
+    header = f"{'scenario':<44}{'mean ms':>10}{'p95 ms':>10}{'parse ms':>10}{'pages':>7}{'pages/s':>10}{'peak KiB':>10}{'blocks':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['scenario']:<44}{row['mean_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['parse_ms']:>10.2f}"
+              f"{row['pages_per_call']:>7.0f}{row['pages_per_sec']:>10.1f}{row['peak_kib']:>10.0f}{row['live_blocks']:>9}")
+
+async def check_parsers(app, base_url):
+    """Run every scenario with each available parser, strained and unstrained, and diff the results."""
+    parsers = ["html.parser"]
+    try:
+        import lxml
+        parsers.append("lxml")
+    except ImportError:
+        pass
+    strainers = {name: getattr(app, name) for name in dir(app) if name.endswith("_STRAINER")}
+
+    results = {}
+    for parser in parsers:
+        for strained in (False, True):
+            app.HTML_PARSER = parser
+            for name, strainer in strainers.items():
+                setattr(app, name, strainer if strained else None)
+            results[(parser, strained)] = {
+                name: json.dumps(await factory(), sort_keys=True)
+                for name, factory in scenarios(app, base_url).items()
+            }
+    for name, strainer in strainers.items():
+        setattr(app, name, strainer)
+
+    baseline = results[("html.parser", False)]
+    failures = 0
+    for (parser, strained), outputs in results.items():
+        for name, output in outputs.items():
+            if output != baseline[name]:
+                failures += 1
+                print(f"MISMATCH {name}: parser={parser} strained={strained}")
+    print(f"checked {len(results)} parser configurations, {failures} mismatches")
+    return failures == 0
+
+def capture():
+    import httpx
+    with httpx.Client(follow_redirects=False, headers={"User-Agent": "Mozilla/5.0"}) as http:
+        for path, route in load_routes().items():
+            if isinstance(route, dict):
+                continue
+            response = http.get(f"{LIVE_BASE_URL}{path}")
+            response.raise_for_status()
+            with open(os.path.join(FIXTURES_DIR, route), "w") as f:
+                f.write(response.text)
+            print(f"saved {path} -> {route}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--parser", choices=["lxml", "html.parser"], default=None)
+    parser.add_argument("--check", action="store_true", help="check that every parser configuration extracts identical results")
+    parser.add_argument("--capture", action="store_true", help="re-download the fixture pages from partselect.com")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    if args.capture:
+        capture()
+        return
+
+    server = start_fixture_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    app = import_app(base_url, args.parser)
+
+    async def run():
+        async with app_runner.running(app):
+            if args.check:
+                return await check_parsers(app, base_url)
+            rows = await run_benchmark(app, base_url, args.rounds)
+            print_report(rows, app.HTML_PARSER, args.rounds)
+            if args.json:
+                with open(args.json, "w") as f:
+                    json.dump({"parser": app.HTML_PARSER, "rounds": args.rounds, "results": rows}, f, indent=2)
+            return True
+
+    ok = asyncio.run(run())
+    server.shutdown()
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
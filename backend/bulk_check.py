@@ -0,0 +1,84 @@
+"""
+Check many model/part pairs for compatibility without going through the chat.
+
+Reads a CSV of model_number,part_number pairs (a header row is optional) and appends one
+JSON line per pair to the output file as each model's parts list is checked. Pairs that
+already have a result in the output are skipped, so an interrupted run picks up where it
+stopped; pairs whose last result was an error are tried again.
+
+    python bulk_check.py pairs.csv results.ndjson
+    python bulk_check.py pairs.csv results.ndjson --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+
+import app_runner
+
+def read_pairs(path):
+    with (sys.stdin if path == "-" else open(path, newline="")) as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            model_number, part_number = row[0].strip(), row[1].strip()
+            if (model_number.lower(), part_number.lower()) == ("model_number", "part_number"):
+                continue
+            yield model_number, part_number
+
+def read_finished(path):
+    """Pairs that already have a non-error result in a previous run's output."""
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short when the last run was interrupted
+            if "error" not in result:
+                finished.add((result["model_number"], result["part_number"]))
+    return finished
+
+def import_app(concurrency=None):
+    env = {"BULK_MODEL_CONCURRENCY": str(concurrency)} if concurrency else {}
+    # No chat traffic to reserve upstream capacity for in this process
+    return app_runner.import_app(env, defaults={"HTTP_BACKGROUND_SHARE": "1"})
+
+async def run(app, pairs, output_path):
+    checked = errors = 0
+    async with app_runner.running(app):
+        with open(output_path, "a") as output:
+            async for result in app.check_compatibility_bulk(pairs):
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                checked += 1
+                errors += "error" in result
+    return checked, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV of model_number,part_number pairs, or - for stdin")
+    parser.add_argument("output", help="NDJSON results file; appended to and used to resume")
+    parser.add_argument("--concurrency", type=int, help="models crawled at once (default BULK_MODEL_CONCURRENCY)")
+    args = parser.parse_args()
+
+    app = import_app(args.concurrency)
+    finished = read_finished(args.output)
+    pairs = [
+        (model_number, part_number) for model_number, part_number in read_pairs(args.input)
+        if (app.normalize_part_number(model_number), app.normalize_part_number(part_number)) not in finished
+    ]
+    print(f"{len(finished)} pairs already checked, {len(pairs)} to go")
+    if not pairs:
+        return
+
+    checked, errors = asyncio.run(run(app, pairs, args.output))
+    print(f"checked {checked} pairs, {errors} errors")
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Crawl partselect.com into the local catalog that app.py can answer from (CATALOG_LOCAL_FIRST=1).
+
+For each model, stores the model page with its manuals, diagrams and videos, its full parts
+list (in the compatibility index) and every part page it links to, using the same scrapers
+the chat tools use. Progress is checkpointed per model and per part page, so an interrupted
+crawl resumes where it stopped; models and parts checked within CATALOG_MAX_AGE are skipped,
+and records whose content did not change are only re-stamped.
+
+    python crawl_catalog.py WDT780SAEM1 WRS325SDHZ00   # crawl these models
+    python crawl_catalog.py --models-file models.txt    # one model number per line
+    python crawl_catalog.py --known                     # every model already in the compatibility index
+    python crawl_catalog.py                             # resume whatever is still pending
+    python crawl_catalog.py WDT780SAEM1 --force         # re-crawl even if fresh
+"""
+import argparse
+import asyncio
+import sys
+
+import app_runner
+
+class CrawlStats:
+    def __init__(self):
+        self.models = 0
+        self.models_changed = 0
+        self.models_failed = 0
+        self.parts = 0
+        self.parts_changed = 0
+        self.parts_skipped = 0
+        self.parts_failed = 0
+
+    def __str__(self):
+        return (f"models: {self.models} crawled ({self.models_changed} changed, {self.models_failed} failed); "
+                f"parts: {self.parts} fetched ({self.parts_changed} changed, {self.parts_skipped} still fresh, {self.parts_failed} failed)")
+
+async def crawl_part(app, part_url, ps_number, force, stats):
+    age = app.catalog.part_age(ps_number)
+    if not force and age is not None and age < app.CATALOG_MAX_AGE:
+        stats.parts_skipped += 1
+        return
+    part_info = await app.scrape_part(part_url)
+    if "error" in part_info or not part_info.get("ps_number"):
+        stats.parts_failed += 1
+        return
+    stats.parts += 1
+    stats.parts_changed += await asyncio.to_thread(app.catalog.save_part, part_info)
+
+async def crawl_model(app, model_number, force, part_concurrency, stats):
+    model_url = f"{app.PARTSELECT_BASE_URL}/Models/{model_number}/"
+    model_info = await app.scrape_model(model_url)
+    if model_info.get("type") == "error":
+        raise RuntimeError(model_info["error"])
+    stats.models_changed += await asyncio.to_thread(app.catalog.save_model, model_number, model_info)
+
+    # Also records the full parts list in the compatibility index
+    parts = await app.crawl_all_parts(model_url)
+    if isinstance(parts, dict):
+        raise RuntimeError(parts["error"])
+
+    semaphore = asyncio.Semaphore(part_concurrency)
+
+    async def bounded_crawl_part(part):
+        async with semaphore:
+            await crawl_part(app, part["url"], part["ps_number"], force, stats)
+
+    await asyncio.gather(*(bounded_crawl_part(part) for part in parts if part.get("url") and part.get("ps_number")))
+    stats.models += 1
+
+async def crawl(app, force, part_concurrency):
+    stats = CrawlStats()
+    async with app_runner.running(app):
+        for model_number in app.catalog.pending_models():
+            print(f"crawling {model_number}")
+            try:
+                await crawl_model(app, model_number, force, part_concurrency, stats)
+                app.catalog.mark_model(model_number, "done")
+            except Exception as e:
+                stats.models_failed += 1
+                app.catalog.mark_model(model_number, "failed")
+                print(f"failed {model_number}: {e}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="*", help="model numbers to crawl")
+    parser.add_argument("--models-file", help="file with one model number per line")
+    parser.add_argument("--known", action="store_true", help="crawl every model in the compatibility index")
+    parser.add_argument("--force", action="store_true", help="re-crawl models and parts even if they are fresh")
+    parser.add_argument("--part-concurrency", type=int, default=4, help="part pages fetched at once per model")
+    args = parser.parse_args()
+
+    app = app_runner.import_app()
+    model_numbers = list(args.models)
+    if args.models_file:
+        with open(args.models_file) as f:
+            model_numbers.extend(line.strip() for line in f if line.strip())
+    if args.known:
+        model_numbers.extend(app.compatibility_index.parts)
+    app.catalog.queue_models(model_numbers, force=args.force)
+
+    pending = app.catalog.pending_models()
+    print(f"{len(pending)} models to crawl")
+    if not pending:
+        return
+    stats = asyncio.run(crawl(app, args.force, args.part_concurrency))
+    print(stats)
+    sys.exit(1 if stats.models_failed else 0)
+
+if __name__ == "__main__":
+    main()
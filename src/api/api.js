@@ -2,9 +2,23 @@ import axios from 'axios';
 
 const API_URL = 'https://partselect-llm-assistant.onrender.com';
 
+// Conversations are kept per session on the backend; one ID per browser tab
+const SESSION_STORAGE_KEY = 'partselect-session-id';
+
+const getSessionId = () => {
+  let sessionId = sessionStorage.getItem(SESSION_STORAGE_KEY);
+  if (!sessionId) {
+    sessionId = window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem(SESSION_STORAGE_KEY, sessionId);
+  }
+  return sessionId;
+};
+
 export const getAIMessage = async (userQuery) => {
   try {
-    const response = await axios.post(`${API_URL}/query`, { query: userQuery });
+    const response = await axios.post(`${API_URL}/query`, { query: userQuery, session_id: getSessionId() });
     console.log("API response:", response.data);
     return {
       response: response.data.response,
@@ -17,9 +31,56 @@ export const getAIMessage = async (userQuery) => {
   }
 };
 
+// Streams a reply from /query/stream. onEvent is called with (event, data) for each
+// server-sent event: tool_start, tool_finish, token and finally done.
+export const streamAIMessage = async (userQuery, onEvent) => {
+  const response = await fetch(`${API_URL}/query/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ query: userQuery, session_id: getSessionId() })
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Streaming request failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      const parsed = data ? JSON.parse(data) : {};
+      if (event === 'done') {
+        result = {
+          response: parsed.response,
+          conversation_ended: parsed.conversation_ended
+        };
+      }
+      onEvent(event, parsed);
+    }
+  }
+
+  return result;
+};
+
 export const resetConversation = async () => {
   try {
-    const response = await axios.post(`${API_URL}/reset`);
+    const response = await axios.post(`${API_URL}/reset`, { session_id: getSessionId() });
     if (response.data && response.data.message === "Conversation reset successfully") {
       console.log("Conversation reset successfully");
       return true;
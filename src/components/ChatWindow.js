@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from "react";
 import "./ChatWindow.css";
-import { getAIMessage } from "../api/api";
+import { streamAIMessage } from "../api/api";
 import { marked } from "marked";
 
 function ChatWindow() {
@@ -45,13 +45,29 @@ How can I assist you today? Just let me know what you need help with!
       setLoadingState("Searching for information on partselect.com");
 
       try {
-        setLoadingState("Generating response");
-        const response = await getAIMessage(input);
+        let streamedContent = "";
+        const response = await streamAIMessage(input, (event, data) => {
+          if (event === "tool_start") {
+            setLoadingState(data.label);
+          } else if (event === "tool_finish") {
+            setLoadingState("Generating response");
+          } else if (event === "token") {
+            // Show the answer as it is generated, replacing the loading bubble
+            const isFirstToken = streamedContent === "";
+            streamedContent += data.content;
+            const content = streamedContent;
+            setIsLoading(false);
+            setMessages(prevMessages => isFirstToken
+              ? [...prevMessages, { role: "assistant", content }]
+              : [...prevMessages.slice(0, -1), { role: "assistant", content }]
+            );
+          }
+        });
         console.log("Received response:", response);
         if (response && response.response) {
           const { content, videoUrl } = processResponse(response.response);
           setMessages(prevMessages => [
-            ...prevMessages,
+            ...(streamedContent ? prevMessages.slice(0, -1) : prevMessages),
             { role: "assistant", content },
             ...(videoUrl ? [{ role: "video", content: videoUrl }] : [])
           ]);